@@ -0,0 +1,230 @@
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+import types
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+import config
+import pipeline
+from frame_cache import ensure_frame_cache
+from video import run_video_config
+
+
+BATCH_MODES = ('analysis', 'video')
+
+# Written into a sequence's output directory once it has been processed completely
+DONE_MARKER = '.done.json'
+
+
+def load_manifest(path):
+    """
+    Read a batch manifest: a JSON object with an optional "defaults" dict of config
+    overrides and a "sequences" list (or just the list). Each sequence is
+    {"image_dir", optional "name", "mode" ('analysis' or 'video') and "config" overrides},
+    e.g. {"image_dir": "clips/cam01", "mode": "video", "config": {"VIDEO_THRESHOLD": ["pixel", 4]}}.
+    Names default to the directory name and must be unique, since they name the outputs.
+    Returns the entries with the defaults merged into their config.
+    """
+    with open(path) as f:
+        manifest = json.load(f)
+    if isinstance(manifest, list):
+        manifest = {'sequences': manifest}
+    defaults = manifest.get('defaults', {})
+    base = os.path.dirname(os.path.abspath(path))
+    entries = []
+    for seq in manifest['sequences']:
+        image_dir = os.path.join(base, seq['image_dir'])
+        mode = seq.get('mode', 'analysis')
+        if mode not in BATCH_MODES:
+            raise ValueError(f"Unknown batch mode: {mode}")
+        entries.append({
+            'name': seq.get('name') or os.path.basename(os.path.normpath(image_dir)),
+            'image_dir': image_dir,
+            'mode': mode,
+            'config': {**defaults, **seq.get('config', {})},
+        })
+    names = [e['name'] for e in entries]
+    duplicates = sorted({n for n in names if names.count(n) > 1})
+    if duplicates:
+        raise ValueError(f"Duplicate sequence names in manifest: {', '.join(duplicates)}")
+    return entries
+
+
+def sequence_config(entry, output_dir):
+    """
+    Config namespace for one sequence: the values of config.py, the entry's overrides,
+    its IMAGE_DIR, and every results directory moved under output_dir/<name>.
+    Sweeps run serially inside a batch worker (the batch itself is the parallel level).
+    """
+    values = {name: getattr(config, name) for name in dir(config) if name.isupper()}
+    values.update(entry['config'])
+    out = os.path.join(output_dir, entry['name'])
+    values.update(
+        IMAGE_DIR=entry['image_dir'],
+        RESULTS_DIR=out,
+        RESULTS_TEMPORAL_DERIVATIVES_ONLY_DIR=os.path.join(out, 'temporal_derivatives_only'),
+        RESULTS_SPATIAL_TEMPORAL_COMBINED_DIR=os.path.join(out, 'spatial_temporal_combined'),
+        RESULTS_THRESHOLD_ANALYSIS_DIR=os.path.join(out, 'threshold_analysis'),
+        VIDEO_OUTPUT_DIR=os.path.join(out, 'video'),
+        SWEEP_WORKERS=1,
+    )
+    return types.SimpleNamespace(**values)
+
+
+def is_done(output_dir, name):
+    return os.path.exists(os.path.join(output_dir, name, DONE_MARKER))
+
+
+def process_sequence(entry, output_dir, figures=False):
+    """
+    Run one manifest entry and write its outputs under output_dir/<name>: the analysis
+    results (tables.txt, result stores and, with figures, the figures) or the video-mode
+    masks and metrics. The done marker is written last, so an interrupted sequence is
+    redone on resume. Errors, including MemoryError from the worker's memory limit, are
+    returned as a failed record rather than raised.
+    """
+    cfg = sequence_config(entry, output_dir)
+    record = {'name': entry['name'], 'mode': entry['mode'], 'pid': os.getpid()}
+    t_start = time.perf_counter()
+    try:
+        os.makedirs(cfg.RESULTS_DIR, exist_ok=True)
+        if entry['mode'] == 'video':
+            record['frames'] = run_video_config(cfg)['frames']
+        else:
+            results = pipeline.run(cfg, figures=figures)
+            with open(os.path.join(cfg.RESULTS_DIR, 'tables.txt'), 'w') as f, contextlib.redirect_stdout(f):
+                pipeline.print_tables(results)
+            # Only the frames around the test frame are decoded
+            record['frames'] = len(results['frames'])
+    except MemoryError:
+        return {**record, 'status': 'failed', 'error': 'memory limit exceeded', 'frames': 0}
+    except Exception as e:
+        return {**record, 'status': 'failed', 'error': f'{type(e).__name__}: {e}', 'frames': 0}
+    record['seconds'] = time.perf_counter() - t_start
+    record['status'] = 'done'
+    marker = os.path.join(cfg.RESULTS_DIR, DONE_MARKER)
+    with open(marker + '.tmp', 'w') as f:
+        json.dump(record, f)
+    os.replace(marker + '.tmp', marker)
+    return record
+
+
+def prepare_frame_caches(entries, output_dir):
+    """
+    Build the frame cache of every distinct image_dir of the analysis-mode entries once,
+    before the workers start, instead of having parallel sequences of one directory wait
+    for each other's build. A directory that fails is left to its sequences, which record
+    the error.
+    """
+    done = set()
+    for entry in entries:
+        cfg = sequence_config(entry, output_dir)
+        key = (os.path.abspath(cfg.IMAGE_DIR), cfg.FRAME_CACHE_DIR)
+        if entry['mode'] != 'analysis' or not cfg.FRAME_CACHE_DIR or key in done:
+            continue
+        done.add(key)
+        try:
+            ensure_frame_cache(cfg.IMAGE_DIR, cfg.FRAME_CACHE_DIR, cfg.FRAME_CACHE_WORKERS)
+        except Exception:
+            pass
+
+
+def _init_worker(memory_limit):
+    # Cap the worker's address space; numpy then raises MemoryError instead of the
+    # kernel killing the process. The processing modules are already imported with
+    # this module, so a worker stays warm for every sequence it is given.
+    if memory_limit and resource is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+
+
+def run_batch(entries, output_dir, workers=None, memory_limit=None, force=False, figures=False, verbose=True):
+    """
+    Process the manifest entries on a pool of `workers` processes (None: one per CPU;
+    1: in this process, without a memory limit). Each worker is limited to memory_limit
+    bytes of address space and handles many sequences, reusing its imports and cached
+    kernels. Sequences whose done marker exists are skipped unless force is set.
+    Frame caches are built up front, once per image directory (prepare_frame_caches).
+    A worker killed outright (e.g. by the OOM killer) breaks the pool: its remaining
+    sequences are reported as failed and are picked up again on the next run.
+    Writes output_dir/batch_summary.json and returns the summary with the aggregate
+    throughput in sequences and frames per second.
+    """
+    pending = [e for e in entries if force or not is_done(output_dir, e['name'])]
+    records = []
+
+    def report(record):
+        records.append(record)
+        if verbose:
+            status = (f"{record['frames']} frames in {record['seconds']:.1f} s" if record['status'] == 'done'
+                      else f"FAILED ({record['error']})")
+            print(f"[{len(records)}/{len(pending)}] {record['name']}: {status}")
+
+    t_start = time.perf_counter()
+    if workers == 1:
+        for entry in pending:
+            report(process_sequence(entry, output_dir, figures))
+    elif pending:
+        prepare_frame_caches(pending, output_dir)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(memory_limit,)) as pool:
+            futures = {pool.submit(process_sequence, entry, output_dir, figures): entry for entry in pending}
+            for future in as_completed(futures):
+                try:
+                    report(future.result())
+                except BrokenProcessPool as e:
+                    entry = futures[future]
+                    report({'name': entry['name'], 'mode': entry['mode'], 'status': 'failed',
+                            'error': f'worker died: {e}', 'frames': 0})
+    wall = time.perf_counter() - t_start
+
+    done = [r for r in records if r['status'] == 'done']
+    frames = sum(r['frames'] for r in done)
+    summary = {
+        'sequences': len(entries), 'skipped': len(entries) - len(pending), 'done': len(done),
+        'failed': len(records) - len(done), 'frames': frames, 'seconds': wall,
+        'sequences_per_s': len(done) / wall if wall > 0 else 0.0,
+        'frames_per_s': frames / wall if wall > 0 else 0.0,
+        'records': records,
+    }
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, 'batch_summary.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def main(argv=None):
+    """
+    Command line entry point: process every sequence of a manifest.
+    Exits with status 1 when a sequence failed.
+    """
+    parser = argparse.ArgumentParser(description='Process many frame directories from a manifest.')
+    parser.add_argument('manifest', help='JSON manifest of sequences (see load_manifest)')
+    parser.add_argument('--output', default=config.BATCH_OUTPUT_DIR, help='root of the per-sequence outputs')
+    parser.add_argument('--workers', type=int, default=config.BATCH_WORKERS,
+                        help='worker processes (default: one per CPU; 1 runs in this process)')
+    parser.add_argument('--memory-limit-gb', type=float, default=config.BATCH_MEMORY_LIMIT_GB,
+                        help='address-space limit of each worker')
+    parser.add_argument('--figures', action='store_true', default=config.BATCH_FIGURES,
+                        help='also render the figures of analysis-mode sequences')
+    parser.add_argument('--force', action='store_true', help='reprocess sequences that are already done')
+    args = parser.parse_args(argv)
+
+    memory_limit = int(args.memory_limit_gb * 1024 ** 3) if args.memory_limit_gb else None
+    summary = run_batch(load_manifest(args.manifest), args.output, args.workers, memory_limit, args.force,
+                        args.figures)
+    print(f"{summary['done']} sequences done, {summary['skipped']} skipped, {summary['failed']} failed; "
+          f"{summary['frames']} frames in {summary['seconds']:.1f} s "
+          f"({summary['sequences_per_s']:.2f} sequences/s, {summary['frames_per_s']:.1f} frames/s)")
+    sys.exit(1 if summary['failed'] else 0)
+
+
+if __name__ == "__main__":
+    main()
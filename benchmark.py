@@ -0,0 +1,318 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+
+import filters
+import metrics
+import thresholds
+import config
+from filters import PRECISION_DTYPES, temporal_margin
+from sparse import sparse_motion_mask
+from sweep import run_sweep
+from synthetic import RESOLUTIONS, synthetic_sequence, motion_ground_truth, mask_iou
+from tiled import tiled_analyze_derivative
+
+
+# Configuration whose masks are compared against the synthetic ground truth: no spatial
+# smoothing and the simple [-1, 0, 1] filter, whose support matches motion_ground_truth(margin=1).
+# MAD(|derivative|) / 0.6745 underestimates the noise sigma, so k is set high enough to
+# reject the sensor noise of the generator
+QUALITY_CONFIG = (None, None, 'simple', None)
+QUALITY_K = 8.0
+
+
+def measure(fn, repeats=5, memory=True):
+    """
+    Wall time of fn() over `repeats` calls (median and minimum, with time.perf_counter) and,
+    with memory=True, the peak traced allocation of one extra call (tracemalloc, which
+    includes numpy buffers).
+    """
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    entry = {'median_s': float(np.median(times)), 'min_s': float(min(times)), 'repeats': repeats}
+    if memory:
+        tracemalloc.start()
+        try:
+            fn()
+            entry['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return entry
+
+
+def benchmark_cases(frames, index, dtype=float, tile_size=256):
+    """
+    (name, callable) for every benchmarked function, named by module. frames is the
+    (T, H, W) synthetic sequence; per-frame functions run at frame `index`, spatial
+    smoothing on the three frames around it.
+    """
+    window = frames[index - 1:index + 2]
+    deriv = filters.spatio_temporal_derivative(frames, index, 'gaussian', 1.5, 'gaussian', 1.5, dtype)
+    abs_d = np.abs(deriv)
+    mask = (abs_d > np.percentile(abs_d, 90)).astype(np.uint8)
+    threshold = QUALITY_K * thresholds.estimate_noise_sigma(deriv)
+    simple_threshold = QUALITY_K * thresholds.estimate_noise_sigma(
+        filters.spatio_temporal_derivative(frames, index, None, None, 'simple', None, dtype))
+    # Kept across repeats, as in a stream where each frame is downsampled only once
+    pyramid, simple_pyramid = {}, {}
+    pixel_model = thresholds.PixelNoiseModel()
+    pixel_model.update(deriv)
+    strategies = ([('fixed', t) for t in config.FIXED_THRESHOLDS] +
+                  [('percentile', p) for p in config.PERCENTILE_VALUES] +
+                  [('noise', k) for k in config.K_VALUES])
+
+    def stream():
+        for _ in filters.stream_temporal_derivatives(iter(frames), 'gaussian', 1.5, dtype):
+            pass
+
+    return [
+        ('filters.simple_derivative_filter', lambda: filters.simple_derivative_filter(frames, index, dtype)),
+        ('filters.gaussian_derivative_filter', lambda: filters.gaussian_derivative_filter(frames, index, 1.5, dtype)),
+        ('filters.temporal_derivative_volume', lambda: filters.temporal_derivative_volume(frames, 'gaussian', 1.5,
+                                                                                           dtype=dtype)),
+        ('filters.causal_gaussian_derivative_volume', lambda: filters.causal_gaussian_derivative_volume(frames, 1.5,
+                                                                                                          dtype=dtype)),
+        ('filters.stream_temporal_derivatives', stream),
+        ('filters.apply_spatial_smoothing[box_5x5]',
+         lambda: filters.apply_spatial_smoothing(window, 'box_5x5', dtype=dtype)),
+        ('filters.apply_spatial_smoothing[box_5x5,fast]',
+         lambda: filters.apply_spatial_smoothing(window, 'box_5x5', dtype=dtype, backend='fast')),
+        ('filters.apply_spatial_smoothing[gaussian_1.5]',
+         lambda: filters.apply_spatial_smoothing(window, 'gaussian', 1.5, dtype=dtype)),
+        ('filters.apply_spatial_smoothing[gaussian_5.0]',
+         lambda: filters.apply_spatial_smoothing(window, 'gaussian', 5.0, dtype=dtype)),
+        ('filters.apply_spatial_smoothing[gaussian_5.0,fast]',
+         lambda: filters.apply_spatial_smoothing(window, 'gaussian', 5.0, dtype=dtype, backend='fast')),
+        ('filters.spatio_temporal_derivative',
+         lambda: filters.spatio_temporal_derivative(frames, index, 'gaussian', 1.5, 'gaussian', 1.5, dtype)),
+        ('thresholds.threshold_percentiles[exact]',
+         lambda: thresholds.threshold_percentiles(deriv, config.PERCENTILE_VALUES)),
+        ('thresholds.threshold_percentiles[histogram]',
+         lambda: thresholds.threshold_percentiles(deriv, config.PERCENTILE_VALUES, method='histogram')),
+        ('thresholds.threshold_noise_model', lambda: thresholds.threshold_noise_model(deriv, QUALITY_K)),
+        ('thresholds.estimate_noise_sigma[exact]', lambda: thresholds.estimate_noise_sigma(deriv)),
+        ('thresholds.estimate_noise_sigma[histogram]', lambda: thresholds.estimate_noise_sigma(deriv, 'histogram')),
+        ('thresholds.RunningNoiseEstimator.update', lambda: thresholds.RunningNoiseEstimator().update(deriv)),
+        ('thresholds.PixelNoiseModel.threshold', lambda: pixel_model.threshold(deriv)),
+        ('metrics.compute_derivative_snr', lambda: metrics.compute_derivative_snr(deriv)),
+        ('metrics.compute_largest_component_ratio', lambda: metrics.compute_largest_component_ratio(mask)),
+        ('metrics.largest_component_sweep', lambda: metrics.largest_component_sweep(abs_d, config.FIXED_THRESHOLDS)),
+        ('metrics.analyze_derivative', lambda: metrics.analyze_derivative(deriv, strategies)),
+        ('metrics.analyze_derivative[sweep]', lambda: metrics.analyze_derivative(deriv, strategies,
+                                                                                 lcc_method='sweep')),
+        ('tiled.tiled_analyze_derivative', lambda: tiled_analyze_derivative(deriv, strategies, tile_size)),
+        ('sparse.sparse_motion_mask',
+         lambda: sparse_motion_mask(frames, index, threshold, 'gaussian', 1.5, 'gaussian', 1.5, dtype=dtype,
+                                    pyramid=pyramid)),
+        ('sparse.sparse_motion_mask[simple]',
+         lambda: sparse_motion_mask(frames, index, simple_threshold, None, None, 'simple', None, dtype=dtype,
+                                    pyramid=simple_pyramid)),
+        ('filters.spatio_temporal_derivative[simple]',
+         lambda: filters.spatio_temporal_derivative(frames, index, None, None, 'simple', None, dtype)),
+        ('sweep.run_sweep', lambda: run_sweep(frames, index, config.SPATIAL_CONFIGS, config.TEMPORAL_CONFIGS,
+                                              config.PERCENTILE_VALUES, dtype=dtype)),
+    ]
+
+
+def detection_quality(frames, masks, dtype=float, n_frames=5, tile_size=256):
+    """
+    Mean IoU with the synthetic ground truth (motion_ground_truth) of the QUALITY_CONFIG
+    mask from the reference path and from each faster path, over n_frames evenly spaced
+    frames. Each path also gets its mean IoU with the reference mask, and the sparse path
+    the mean fraction of blocks it filtered.
+    """
+    s_method, s_param, t_method, t_param = QUALITY_CONFIG
+    margin = temporal_margin(t_method, t_param)
+    indices = np.linspace(margin, len(frames) - margin - 1, n_frames).astype(int)
+    paths = ('reference', 'histogram', 'float32', 'tiled', 'sparse')
+    iou_truth = {p: [] for p in paths}
+    iou_reference = {p: [] for p in paths}
+    active = []
+    for index in indices:
+        truth = motion_ground_truth(masks, index, margin)
+        deriv = filters.spatio_temporal_derivative(frames, index, s_method, s_param, t_method, t_param, dtype)
+        strategy = [('noise', QUALITY_K)]
+        _, (ref,) = metrics.analyze_derivative(deriv, strategy)
+        deriv32 = filters.spatio_temporal_derivative(frames, index, s_method, s_param, t_method, t_param, np.float32)
+        sparse_mask, _, sparse_filtered, _ = sparse_motion_mask(frames, index, ref['threshold'], s_method,
+                                                                s_param, t_method, t_param, dtype=dtype)
+        active.append(sparse_filtered.mean())
+        path_masks = {
+            'reference': ref['mask'],
+            'histogram': metrics.analyze_derivative(deriv, strategy, 'histogram', 'histogram')[1][0]['mask'],
+            'float32': metrics.analyze_derivative(deriv32, strategy)[1][0]['mask'],
+            'tiled': tiled_analyze_derivative(deriv, strategy, tile_size)[1][0]['mask'],
+            'sparse': sparse_mask,
+        }
+        for path, mask in path_masks.items():
+            iou_truth[path].append(mask_iou(mask, truth))
+            iou_reference[path].append(mask_iou(mask, ref['mask']))
+    quality = {p: {'iou_truth': float(np.mean(iou_truth[p])), 'iou_reference': float(np.mean(iou_reference[p]))}
+               for p in paths}
+    quality['sparse']['active_fraction'] = float(np.mean(active))
+    return quality
+
+
+def git_revision():
+    """
+    Short hash of the checked-out commit, with '-dirty' for uncommitted changes (None outside git).
+    """
+    try:
+        rev = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                             check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True,
+                               text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return rev + '-dirty' if dirty else rev
+
+
+def run_benchmarks(resolution='vga', n_frames=40, repeats=5, precision='float64', only=None, memory=True,
+                   quality=True, speed=4.0, size=40, noise_sigma=2.0, seed=0, tile_size=256):
+    """
+    Generate a synthetic sequence and measure every case of benchmark_cases whose name
+    starts with one of the `only` prefixes (all by default), plus detection_quality.
+    Returns the report dict written by save_report.
+    """
+    height, width = RESOLUTIONS[resolution]
+    frames, masks = synthetic_sequence(n_frames, height, width, speed=speed, size=size,
+                                       noise_sigma=noise_sigma, seed=seed)
+    frame_dtype, work_dtype = PRECISION_DTYPES[precision]
+    frames = frames.astype(frame_dtype, copy=False)
+    results = {}
+    for name, fn in benchmark_cases(frames, n_frames // 2, work_dtype, tile_size):
+        if only and not name.startswith(tuple(only)):
+            continue
+        results[name] = measure(fn, repeats, memory)
+        print(f"{name:<52} {1000 * results[name]['median_s']:>10.2f} ms"
+              + (f" {results[name]['peak_bytes'] / 2 ** 20:>9.1f} MiB" if memory else ''))
+    return {
+        'meta': {
+            'revision': git_revision(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+            'cpus': os.cpu_count(), 'resolution': resolution, 'shape': [n_frames, height, width],
+            'precision': precision, 'repeats': repeats, 'speed': speed, 'size': size,
+            'noise_sigma': noise_sigma, 'seed': seed,
+        },
+        'results': results,
+        'quality': detection_quality(frames, masks, work_dtype, tile_size=tile_size) if quality else {},
+    }
+
+
+def save_report(report, path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+def compare_reports(baseline, current, tolerance=1.10, iou_tolerance=0.01):
+    """
+    Print the per-function time and peak-memory ratios of current vs baseline.
+    A function regresses when its median time or peak memory grows by more than `tolerance`,
+    a fast path when its IoU with the ground truth drops by more than iou_tolerance.
+    Returns the list of regressions.
+    """
+    regressions = []
+    print(f"{'Function':<52} {'Base ms':>10} {'Now ms':>10} {'Time x':>7} {'Mem x':>7}")
+    for name, now in current['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            print(f"{name:<52} {'-':>10} {1000 * now['median_s']:>10.2f}")
+            continue
+        time_ratio = now['median_s'] / base['median_s'] if base['median_s'] else 1.0
+        mem_ratio = (now['peak_bytes'] / base['peak_bytes']
+                     if base.get('peak_bytes') and 'peak_bytes' in now else 1.0)
+        flag = ''
+        if time_ratio > tolerance or mem_ratio > tolerance:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f"{name:<52} {1000 * base['median_s']:>10.2f} {1000 * now['median_s']:>10.2f} "
+              f"{time_ratio:>7.2f} {mem_ratio:>7.2f}{flag}")
+    for path, now in current.get('quality', {}).items():
+        base = baseline.get('quality', {}).get(path)
+        if base is not None and now['iou_truth'] < base['iou_truth'] - iou_tolerance:
+            regressions.append(f'quality.{path}')
+            print(f"quality.{path}: IoU {base['iou_truth']:.4f} -> {now['iou_truth']:.4f}  REGRESSION")
+    return regressions
+
+
+def print_quality(report, iou_tolerance=0.01):
+    """
+    IoU table of detection_quality; a faster path is flagged when it detects worse than
+    the reference path by more than iou_tolerance.
+    """
+    quality = report['quality']
+    if not quality:
+        return []
+    worse = []
+    ref = quality['reference']['iou_truth']
+    print(f"{'Path':<12} {'IoU truth':>10} {'IoU ref':>8}")
+    for path, q in quality.items():
+        flag = ''
+        if q['iou_truth'] < ref - iou_tolerance:
+            worse.append(path)
+            flag = '  WORSE THAN REFERENCE'
+        if 'active_fraction' in q:
+            flag += f"  ({100 * q['active_fraction']:.1f}% of blocks filtered)"
+        print(f"{path:<12} {q['iou_truth']:>10.4f} {q['iou_reference']:>8.4f}{flag}")
+    return worse
+
+
+def main(argv=None):
+    """
+    Command line entry point: benchmark on a synthetic sequence and save a JSON report,
+    optionally comparing it with a baseline; or compare two saved reports.
+    Exits with status 1 when a regression is found.
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the filters, thresholds and metrics on synthetic video.')
+    parser.add_argument('--resolution', default=config.BENCHMARK_RESOLUTION, choices=sorted(RESOLUTIONS))
+    parser.add_argument('--frames', type=int, default=config.BENCHMARK_FRAMES)
+    parser.add_argument('--repeats', type=int, default=config.BENCHMARK_REPEATS)
+    parser.add_argument('--precision', default=config.PRECISION, choices=sorted(PRECISION_DTYPES))
+    parser.add_argument('--only', nargs='+', default=None,
+                        help='benchmark only the functions whose name starts with one of these prefixes')
+    parser.add_argument('--speed', type=float, default=4.0, help='object speed in pixels per frame')
+    parser.add_argument('--size', type=int, default=40, help='object size in pixels')
+    parser.add_argument('--noise', type=float, default=2.0, help='sensor noise sigma in gray levels')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc pass')
+    parser.add_argument('--no-quality', action='store_true', help='skip the IoU check against the ground truth')
+    parser.add_argument('--output', default=None,
+                        help=f'report path (default: {config.BENCHMARK_DIR}/<revision>-<resolution>.json)')
+    parser.add_argument('--baseline', default=None, help='report to compare this run against')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'), default=None,
+                        help='compare two saved reports without running anything')
+    parser.add_argument('--tolerance', type=float, default=config.BENCHMARK_TOLERANCE,
+                        help='time / memory ratio above which a function counts as a regression')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as f, open(args.compare[1]) as g:
+            regressions = compare_reports(json.load(f), json.load(g), args.tolerance)
+        sys.exit(1 if regressions else 0)
+
+    report = run_benchmarks(args.resolution, args.frames, args.repeats, args.precision, args.only,
+                            not args.no_memory, not args.no_quality, args.speed, args.size, args.noise, args.seed)
+    worse = print_quality(report)
+    output = args.output or os.path.join(config.BENCHMARK_DIR,
+                                         f"{report['meta']['revision'] or 'report'}-{args.resolution}.json")
+    save_report(report, output)
+    print(f"Saved {output}")
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_reports(json.load(f), report, args.tolerance)
+    sys.exit(1 if worse or regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
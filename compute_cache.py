@@ -0,0 +1,151 @@
+import hashlib
+import os
+import weakref
+from collections import OrderedDict
+import numpy as np
+
+from filters import apply_spatial_smoothing, simple_derivative_filter, gaussian_derivative_filter
+
+
+_fingerprints = {}
+
+
+def array_fingerprint(frames_array):
+    """
+    Content hash identifying a frame set. The hash is remembered for the lifetime of
+    the array, so arrays must not be modified in place after being cached on.
+    """
+    entry = _fingerprints.get(id(frames_array))
+    if entry is not None and entry[0]() is frames_array:
+        return entry[1]
+    arr = np.ascontiguousarray(frames_array)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str((arr.shape, arr.dtype.str)).encode())
+    h.update(arr.data)
+    fingerprint = h.hexdigest()
+    try:
+        ref = weakref.ref(frames_array, lambda _, key=id(frames_array): _fingerprints.pop(key, None))
+        _fingerprints[id(frames_array)] = (ref, fingerprint)
+    except TypeError:
+        pass
+    return fingerprint
+
+
+class ComputeCache:
+    """
+    Content-keyed LRU cache for smoothed volumes and derivatives.
+    Entries are kept in memory up to max_bytes (least recently used evicted first).
+    With spill_dir set, computed arrays are also written to disk and reloaded from there
+    on a memory miss, so results are shared across runs. The spill directory is limited
+    to spill_max_bytes the same way, deleting its least recently used files (by
+    modification time, refreshed on every disk hit).
+    Cached arrays are returned read-only, so callers cannot modify them for later hits.
+    """
+
+    def __init__(self, max_bytes, spill_dir=None, spill_max_bytes=8 * 1024 ** 3):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.spill_max_bytes = spill_max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._spilled = OrderedDict()
+        self._spill_nbytes = 0
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+            # Files left by earlier runs, oldest first
+            files = []
+            for name in os.listdir(spill_dir):
+                if name.endswith('.npy') and not name.endswith('.tmp.npy'):
+                    stat = os.stat(os.path.join(spill_dir, name))
+                    files.append((stat.st_mtime, name, stat.st_size))
+            for _, name, size in sorted(files):
+                self._spilled[name] = size
+                self._spill_nbytes += size
+            self._evict_spilled()
+
+    def _spill_path(self, key):
+        name = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.spill_dir, name + '.npy')
+
+    def _evict_spilled(self):
+        while self._spill_nbytes > self.spill_max_bytes and self._spilled:
+            name, size = self._spilled.popitem(last=False)
+            self._spill_nbytes -= size
+            try:
+                os.remove(os.path.join(self.spill_dir, name))
+            except FileNotFoundError:
+                pass
+
+    def _spill(self, key, value):
+        if value.nbytes > self.spill_max_bytes:
+            return
+        path = self._spill_path(key)
+        tmp_path = path + '.tmp.npy'
+        np.save(tmp_path, value)
+        os.replace(tmp_path, path)
+        name = os.path.basename(path)
+        self._spill_nbytes += os.path.getsize(path) - self._spilled.pop(name, 0)
+        self._spilled[name] = os.path.getsize(path)
+        self._evict_spilled()
+
+    def _insert(self, key, value):
+        size = value.nbytes if value is not None else 0
+        if value is not None:
+            value.flags.writeable = False
+        self._entries[key] = value
+        self._nbytes += size
+        while self._nbytes > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self._nbytes -= evicted.nbytes if evicted is not None else 0
+
+    def get_or_compute(self, key, compute):
+        """
+        Return the cached value for key, calling compute() only on a miss.
+        """
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+        path = self._spill_path(key) if self.spill_dir else None
+        if path and os.path.exists(path):
+            self.hits += 1
+            value = np.load(path)
+            os.utime(path)
+            name = os.path.basename(path)
+            if name in self._spilled:
+                self._spilled.move_to_end(name)
+            self._insert(key, value)
+            return value
+        self.misses += 1
+        value = compute()
+        if path and value is not None:
+            self._spill(key, value)
+        self._insert(key, value)
+        return value
+
+
+def cached_spatial_smoothing(cache, frames_array, method, sigma_input=None, dtype=float, backend='exact'):
+    """
+    apply_spatial_smoothing through the cache; without a cache it is computed directly.
+    """
+    compute = lambda: apply_spatial_smoothing(frames_array, method, sigma_input, dtype=dtype, backend=backend)
+    if cache is None:
+        return compute()
+    key = ('smooth', array_fingerprint(frames_array), method, sigma_input, np.dtype(dtype).str, backend)
+    return cache.get_or_compute(key, compute)
+
+
+def cached_temporal_derivative(cache, frames_array, index, method, sigma=None, dtype=float):
+    """
+    Temporal derivative at frame index ('simple' or 'gaussian') through the cache.
+    """
+    if method == 'simple':
+        compute = lambda: simple_derivative_filter(frames_array, index, dtype=dtype)
+    else:
+        compute = lambda: gaussian_derivative_filter(frames_array, index, sigma, dtype=dtype)
+    if cache is None:
+        return compute()
+    key = ('deriv', array_fingerprint(frames_array), index, method, sigma, np.dtype(dtype).str)
+    return cache.get_or_compute(key, compute)
@@ -1,5 +1,19 @@
 # Image directory
 IMAGE_DIR = "path to your frames directory"
+
+# Decoded-frame cache (uint8 memmap reused across runs); set to None to always decode
+FRAME_CACHE_DIR = '.frame_cache'
+FRAME_CACHE_WORKERS = None  # None lets the thread pool pick the worker count
+
+# Numeric precision of the pipeline:
+#   'float64' - frames, filtering and derivatives in float64 (reference results)
+#   'float32' - raw frames kept as uint8, filtering and derivatives in float32
+PRECISION = 'float64'
+
+# Cache for smoothed volumes and derivatives shared between sweeps and visualizations
+COMPUTE_CACHE_MAX_BYTES = 2 * 1024 ** 3
+COMPUTE_CACHE_DIR = None  # set to a directory to also keep results on disk across runs
+COMPUTE_CACHE_DIR_MAX_BYTES = 8 * 1024 ** 3  # disk budget of COMPUTE_CACHE_DIR (oldest files deleted first)
 # Temporal sigma values for Gaussian derivative filter
 TEMPORAL_SIGMA_VALUES = [0.5, 1.5, 5.0]
 
@@ -9,13 +23,26 @@ SPATIAL_SIGMA_VALUES = [0.5, 1.5, 5.0]
 # Percentile values for thresholding
 PERCENTILE_VALUES = [80, 85, 90, 95]
 
+# How percentile thresholds are selected: 'exact' (one partition for all percentiles)
+# or 'histogram' (one cumulative histogram, accurate to max|derivative| / 4096)
+PERCENTILE_METHOD = 'exact'
+
 # Fixed threshold values for Threshold Analysis
 FIXED_THRESHOLDS = [2, 5, 10, 15, 20, 30, 50]
 
 # K values for noise model threshold
 K_VALUES = [2.0, 3.0, 4.0, 5.0]
 
-# Spatial filter configurations
+# Noise-model median/MAD estimation: 'exact' (np.median) or 'histogram' (fixed-bin, O(n))
+NOISE_METHOD = 'exact'
+
+# Spatial smoothing backend: 'exact' (scipy filters) or 'fast' (summed-area-table box
+# filters and recursive Gaussian for large sigma, cost independent of kernel size). The
+# fast box filters match scipy; the recursive Gaussian is approximate, within ~3% of the
+# value range of gaussian_filter (worst next to small bright blobs)
+SPATIAL_BACKEND = 'exact'
+
+# Spatial filter configurations; ('Box 9x9', 'box', 9) selects an arbitrary box size
 SPATIAL_CONFIGS = [
     ('Box 3x3',      'box_3x3',  None),
     ('Box 5x5',      'box_5x5',  None),
@@ -32,6 +59,62 @@ TEMPORAL_CONFIGS = [
     ('DoG ts=5.0',      'gaussian', 5.0),
 ]
 
+# Worker processes for the spatial x temporal x percentile sweep (1 runs serially)
+SWEEP_WORKERS = 1
+
+# Save the result tables, bit-packed masks and derivatives under each results directory
+SAVE_RESULTS_STORE = True
+
+# Figure rendering: 'matplotlib' (annotated subplot grids) or 'pil' (native-resolution
+# NumPy canvases written with PIL, in parallel; histogram figures still use matplotlib)
+RENDER_BACKEND = 'matplotlib'
+RENDER_WORKERS = None
+# Do not redraw figures whose inputs are unchanged since the last run
+RENDER_SKIP_UNCHANGED = True
+
+# Full-video mode (python main.py --video): one configuration applied to every frame
+VIDEO_OUTPUT_DIR = 'results/video'
+VIDEO_SPATIAL = ('gaussian', 1.5)      # (method, param); method None for no smoothing
+VIDEO_TEMPORAL = ('gaussian', 1.5)     # (method, sigma); 'simple', 'gaussian' or 'causal'
+VIDEO_THRESHOLD = ('percentile', 90)   # ('fixed', value), ('percentile', p), ('noise', k) or ('pixel', k)
+VIDEO_RUNNING_NOISE = True             # 'noise' threshold tracks sigma_noise across frames
+VIDEO_PIXEL_NOISE_ALPHA = 0.05         # update weight of the per-pixel noise model ('pixel')
+VIDEO_MASK_FORMAT = 'packed'           # 'packed' (chunked bit-packed .npy) or 'png'
+VIDEO_CHUNK_FRAMES = 256
+# Filter, threshold and measure each frame in tiles of this size (None: whole frames), so
+# the filter and threshold temporaries stay at one tile on very high-resolution footage
+# (the frame window, derivative and mask are still whole frames). Results are identical
+# with Gaussian or no smoothing; box filters give the derivative to rounding, which can
+# move the SNR slightly. The 'causal' temporal filter is not tiled. Requires the 'exact'
+# PERCENTILE_METHOD and NOISE_METHOD
+VIDEO_TILE_SIZE = None
+# Overlap decoding, filtering, thresholding and writing on threads with bounded queues
+VIDEO_PIPELINED = True
+VIDEO_QUEUE_SIZE = 4
+
+# Benchmark suite (python benchmark.py): synthetic sequence size, timing repeats, where the
+# JSON reports go and the slowdown ratio counted as a regression when comparing reports
+BENCHMARK_RESOLUTION = 'vga'   # 'vga', '720p', '1080p', '4k' or '8k'
+BENCHMARK_FRAMES = 40
+BENCHMARK_REPEATS = 5
+BENCHMARK_DIR = 'benchmarks'
+BENCHMARK_TOLERANCE = 1.10
+
+# Per-stage profiling (python main.py --profile trace.json): wall time, calls, allocated
+# bytes (with PROFILE_MEMORY, via tracemalloc) and peak RSS of each stage and configuration.
+# PROFILE_TRACE ending in .csv writes the summary table, otherwise the JSON events + summary
+PROFILE_TRACE = None
+PROFILE_MEMORY = False
+PROFILE_CHROME_TRACE = None  # also write a Chrome trace (chrome://tracing, Perfetto)
+
+# Batch runner (python batch.py manifest.json): per-sequence outputs go to
+# BATCH_OUTPUT_DIR/<name>; workers default to one per CPU, each limited to
+# BATCH_MEMORY_LIMIT_GB of address space (None: unlimited)
+BATCH_OUTPUT_DIR = 'results/batch'
+BATCH_WORKERS = None
+BATCH_MEMORY_LIMIT_GB = None
+BATCH_FIGURES = False
+
 # Results directory structure
 RESULTS_DIR = 'results'
 RESULTS_TEMPORAL_DERIVATIVES_ONLY_DIR = 'results/temporal_derivatives_only'
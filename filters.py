@@ -1,18 +1,31 @@
+import functools
 import numpy as np
-from scipy.ndimage import gaussian_filter1d, gaussian_filter, uniform_filter
+from scipy.ndimage import gaussian_filter1d, gaussian_filter, uniform_filter, correlate1d
 
+from frame_source import FrameRingBuffer
+from profiling import profiled
 
-def simple_derivative_filter(frames, index):
+
+# Precision modes: (raw frame dtype, filtering and derivative dtype)
+PRECISION_DTYPES = {
+    'float64': (np.float64, np.float64),
+    'float32': (np.uint8, np.float32),
+}
+
+
+@profiled()
+def simple_derivative_filter(frames, index, dtype=float):
     """
     Apply simple 0.5[-1, 0, 1] central difference filter along the temporal axis.
     Computes the temporal derivative at frame[index] using its two neighbors.
     """
     if index == 0 or index >= len(frames) - 1:
         return None
-    return 0.5 * (frames[index + 1] - frames[index - 1])
+    return dtype(0.5) * (np.asarray(frames[index + 1], dtype=dtype) - frames[index - 1])
 
 
-def gaussian_derivative_filter(frames_array, index, sigma):
+@profiled()
+def gaussian_derivative_filter(frames_array, index, sigma, dtype=float):
     """
     Apply 1D derivative of Gaussian along the temporal axis at frame[index].
     """
@@ -22,24 +35,325 @@ def gaussian_derivative_filter(frames_array, index, sigma):
     # Extract temporal window centered on target frame
     start = index - margin
     end = index + margin + 1
-    window = frames_array[start:end].astype(float)
+    window = frames_array[start:end].astype(dtype)
     # Apply derivative of Gaussian along temporal axis (axis=0)
     deriv_vol = gaussian_filter1d(window, sigma=sigma, axis=0, order=1)
     # Return only the center frame's derivative
     return deriv_vol[margin]
 
 
-def apply_spatial_smoothing(frames_array, method, sigma_input=None):
+@functools.lru_cache(maxsize=64)
+def temporal_derivative_kernel(method, sigma=None):
+    """
+    Return the 1D temporal weights used by the derivative filters, ordered from the
+    oldest to the newest frame of the window.
+    The Gaussian weights reproduce gaussian_derivative_filter exactly, including the
+    reflection of the kernel tails inside the 2*margin+1 window.
+    Kernels are cached per (method, sigma), since tiled and streaming callers request
+    them for every tile and frame, and returned read-only.
+    """
+    if method == 'simple':
+        weights = np.array([-0.5, 0.0, 0.5])
+    elif method == 'gaussian':
+        margin = int(np.ceil(3 * sigma))
+        impulses = np.eye(2 * margin + 1)
+        weights = gaussian_filter1d(impulses, sigma=sigma, axis=0, order=1)[margin].copy()
+    else:
+        raise ValueError(f"Unknown temporal method: {method}")
+    weights.setflags(write=False)
+    return weights
+
+
+@profiled()
+def temporal_derivative_volume(frames_array, method, sigma=None, mode='valid', dtype=float):
+    """
+    Compute the temporal derivative of every frame in a single vectorized pass.
+    mode='valid' returns only the frames with full temporal support, i.e. frames
+    margin .. T-margin-1, so the output has shape (T - 2*margin, H, W).
+    mode='reflect' or 'nearest' extends the sequence at both ends and returns (T, H, W).
+    """
+    weights = temporal_derivative_kernel(method, sigma).astype(dtype)
+    margin = len(weights) // 2
+    frames_array = np.asarray(frames_array)
+    if mode == 'valid':
+        n_out = len(frames_array) - 2 * margin
+        if n_out <= 0:
+            return np.zeros((0,) + frames_array.shape[1:], dtype=dtype)
+        deriv_vol = np.zeros((n_out,) + frames_array.shape[1:], dtype=dtype)
+        for j, w in enumerate(weights):
+            if w != 0:
+                deriv_vol += w * frames_array[j:j + n_out]
+        return deriv_vol
+    if mode in ('reflect', 'nearest'):
+        return correlate1d(frames_array, weights, axis=0, output=dtype, mode=mode)
+    raise ValueError(f"Unknown boundary mode: {mode}")
+
+
+def simple_derivative_volume(frames_array, mode='valid', dtype=float):
+    """
+    Batch version of simple_derivative_filter over the whole sequence.
+    """
+    return temporal_derivative_volume(frames_array, 'simple', mode=mode, dtype=dtype)
+
+
+def gaussian_derivative_volume(frames_array, sigma, mode='valid', dtype=float):
+    """
+    Batch version of gaussian_derivative_filter over the whole sequence.
+    """
+    return temporal_derivative_volume(frames_array, 'gaussian', sigma, mode=mode, dtype=dtype)
+
+
+def temporal_margin(method, sigma=None):
+    """
+    Number of frames needed on each side of the target frame by a temporal filter.
+    """
+    return len(temporal_derivative_kernel(method, sigma)) // 2
+
+
+def spatial_margin(method, sigma_input=None):
+    """
+    Number of pixels on each side of a pixel read by a spatial filter of apply_spatial_smoothing
+    (exact backend). Tiles extended by this halo are filtered exactly like the whole frame.
+    """
+    if method is None:
+        return 0
+    if method in BOX_SIZES or method == 'box':
+        return (BOX_SIZES.get(method) or int(sigma_input)) // 2
+    if method == 'gaussian':
+        # gaussian_filter's default truncate=4.0
+        return int(4.0 * sigma_input + 0.5)
+    raise ValueError(f"Unknown spatial method: {method}")
+
+
+def stream_temporal_derivatives(frames, method, sigma=None, dtype=float, spatial_method=None, spatial_param=None):
+    """
+    Consume an iterable of frames and yield (index, derivative) for every frame with
+    full temporal support, keeping only the 2*margin+1 frames the kernel needs.
+    With spatial_method set, the derivative is smoothed once after the temporal
+    combination, as in spatio_temporal_derivative.
+    """
+    weights = temporal_derivative_kernel(method, sigma).astype(dtype)
+    margin = len(weights) // 2
+    buffer = FrameRingBuffer(len(weights))
+    for frame in frames:
+        buffer.append(frame)
+        index = len(buffer) - 1 - margin
+        if index < margin:
+            continue
+        deriv = np.zeros(buffer[index].shape, dtype=dtype)
+        for j, w in enumerate(weights):
+            if w != 0:
+                deriv += w * buffer[index - margin + j]
+        if spatial_method is not None:
+            deriv = smooth_frame(deriv, spatial_method, spatial_param, dtype)
+        yield index, deriv
+
+
+class CausalGaussianDerivative:
+    """
+    Causal recursive approximation of the temporal derivative of Gaussian.
+    The input is smoothed by a cascade of n_stages first-order recursive filters whose
+    total variance equals sigma**2 (a time-causal Gaussian analogue), and the derivative
+    is the backward difference of the smoothed signal. Only n_stages + 1 frames of state
+    are kept and the cost per frame does not depend on sigma.
+    The response lags the non-causal DoG by `delay` frames (the mean of the kernel).
+    """
+
+    def __init__(self, sigma, n_stages=4, dtype=float):
+        self.sigma = sigma
+        self.n_stages = n_stages
+        self.dtype = dtype
+        self.mu = (np.sqrt(1 + 4 * sigma ** 2 / n_stages) - 1) / 2
+        self.delay = n_stages * self.mu
+        self.reset()
+
+    def reset(self):
+        self._stages = None
+        self._previous = None
+
+    def update(self, frame):
+        """
+        Feed the next frame and return the derivative at the current time step.
+        """
+        x = np.asarray(frame, dtype=self.dtype)
+        if self._stages is None:
+            # Start from steady state so the first derivative is zero
+            self._stages = [x.copy() for _ in range(self.n_stages)]
+            self._previous = x.copy()
+        gain = self.dtype(1.0 / (1.0 + self.mu))
+        for stage in self._stages:
+            stage += gain * (x - stage)
+            x = stage
+        deriv = x - self._previous
+        self._previous[...] = x
+        return deriv
+
+
+@profiled()
+def causal_gaussian_derivative_volume(frames_array, sigma, n_stages=4, dtype=float):
+    """
+    Batch version of CausalGaussianDerivative over the whole sequence, shape (T, H, W).
+    Frame t only depends on frames 0..t.
+    """
+    # scipy.signal is slow to import and only needed here and in the recursive Gaussian
+    from scipy.signal import lfilter
+
+    frames_array = np.asarray(frames_array, dtype=dtype)
+    if len(frames_array) == 0:
+        return np.zeros(frames_array.shape, dtype=dtype)
+    mu = (np.sqrt(1 + 4 * sigma ** 2 / n_stages) - 1) / 2
+    a = mu / (1.0 + mu)
+    b_coeffs = np.array([1.0 - a], dtype=dtype)
+    a_coeffs = np.array([1.0, -a], dtype=dtype)
+    smoothed = frames_array
+    for _ in range(n_stages):
+        zi = a_coeffs.dtype.type(a) * smoothed[:1]
+        smoothed, _ = lfilter(b_coeffs, a_coeffs, smoothed, axis=0, zi=zi)
+    return np.diff(smoothed, axis=0, prepend=smoothed[:1])
+
+
+# Box sizes of the named box filters
+BOX_SIZES = {'box_3x3': 3, 'box_5x5': 5}
+
+# With backend='fast', Gaussians at or above this sigma use the recursive filter
+# (roughly where it overtakes gaussian_filter on 4K frames)
+RECURSIVE_GAUSSIAN_MIN_SIGMA = 10.0
+
+
+def box_filter_sat(frames_array, size, dtype=float):
+    """
+    Box filter of any size over the last two axes using summed-area tables.
+    Matches uniform_filter (reflect boundary) at a cost independent of the box size.
+    """
+    frames_array = np.asarray(frames_array)
+    before, after = size // 2, size - 1 - size // 2
+    pad = [(0, 0)] * (frames_array.ndim - 2) + [(before + 1, after), (before + 1, after)]
+    # The extra leading row/column of the padding is zeroed to act as the table origin
+    sat = np.pad(frames_array.astype(np.float64), pad, mode='symmetric')
+    sat[..., 0, :] = 0
+    sat[..., :, 0] = 0
+    np.cumsum(sat, axis=-2, out=sat)
+    np.cumsum(sat, axis=-1, out=sat)
+    box = (sat[..., size:, size:] - sat[..., :-size, size:]
+           - sat[..., size:, :-size] + sat[..., :-size, :-size])
+    return (box / (size * size)).astype(dtype)
+
+
+def _recursive_gaussian_coefficients(sigma):
+    # Young & van Vliet (1995) third-order recursive approximation of the Gaussian
+    if sigma >= 2.5:
+        q = 0.98711 * sigma - 0.96330
+    else:
+        q = 3.97156 - 4.14554 * np.sqrt(1 - 0.26891 * sigma)
+    b0 = 1.57825 + 2.44413 * q + 1.4281 * q ** 2 + 0.422205 * q ** 3
+    b1 = 2.44413 * q + 2.85619 * q ** 2 + 1.26661 * q ** 3
+    b2 = -(1.4281 * q ** 2 + 1.26661 * q ** 3)
+    b3 = 0.422205 * q ** 3
+    scale = 1 - (b1 + b2 + b3) / b0
+    return np.array([scale]), np.array([1.0, -b1 / b0, -b2 / b0, -b3 / b0])
+
+
+def _recursive_gaussian_1d(x, sigma, axis):
+    from scipy.signal import lfilter, lfilter_zi
+
+    # Coefficients in the data's dtype so lfilter does not upcast float32 frames
+    b, a = (c.astype(x.dtype) for c in _recursive_gaussian_coefficients(sigma))
+    margin = int(np.ceil(4 * sigma))
+    pad = [(0, 0)] * x.ndim
+    pad[axis] = (margin, margin)
+    x = np.pad(x, pad, mode='symmetric')
+    zi_shape = [1] * x.ndim
+    zi_shape[axis] = len(a) - 1
+    zi = lfilter_zi(b, a).astype(x.dtype).reshape(zi_shape)
+    # Causal pass followed by anti-causal pass, both started from steady state
+    first = np.take(x, [0], axis=axis)
+    y, _ = lfilter(b, a, x, axis=axis, zi=zi * first)
+    y = np.flip(y, axis=axis)
+    first = np.take(y, [0], axis=axis)
+    y, _ = lfilter(b, a, y, axis=axis, zi=zi * first)
+    y = np.flip(y, axis=axis)
+    return np.take(y, np.arange(margin, y.shape[axis] - margin), axis=axis)
+
+
+def recursive_gaussian_filter(frames_array, sigma, dtype=float):
+    """
+    Gaussian smoothing over the last two axes with the recursive Young-van Vliet filter,
+    computed in dtype. The cost per pixel does not depend on sigma, but the result only
+    approximates gaussian_filter: for sigma 10-24 it differs by up to ~3% of the value
+    range next to small bright blobs and ~1% at step edges (~0.15% on noise-like texture).
+    In float32 the recursion adds up to ~0.2% of the value range at sigma 24.
+    """
+    smoothed = np.asarray(frames_array, dtype=dtype)
+    smoothed = _recursive_gaussian_1d(smoothed, sigma, axis=-2)
+    return _recursive_gaussian_1d(smoothed, sigma, axis=-1)
+
+
+@profiled()
+def apply_spatial_smoothing(frames_array, method, sigma_input=None, dtype=float, backend='exact'):
     """
     Apply 2D spatial smoothing to each frame independently.
-    Supports box filters (3x3, 5x5) and Gaussian with user-defined sigma.
-    """
-    smoothed = np.zeros_like(frames_array, dtype=float)
-    for i in range(len(frames_array)):
-        if method == 'box_3x3':
-            smoothed[i] = uniform_filter(frames_array[i].astype(float), size=3)
-        elif method == 'box_5x5':
-            smoothed[i] = uniform_filter(frames_array[i].astype(float), size=5)
-        elif method == 'gaussian':
-            smoothed[i] = gaussian_filter(frames_array[i].astype(float), sigma=sigma_input)
-    return smoothed
+    Supports box filters ('box_3x3', 'box_5x5', or 'box' with sigma_input as the box size)
+    and Gaussian with user-defined sigma. The whole (T, H, W) stack is filtered in one call.
+    backend='fast' computes box filters from summed-area tables (same result) and
+    large-sigma Gaussians recursively (an approximation, see recursive_gaussian_filter), so
+    the cost does not grow with the kernel size.
+    """
+    frames_array = np.asarray(frames_array)
+    # Leading (temporal) axes get a unit box / zero sigma so frames are never mixed
+    n_lead = frames_array.ndim - 2
+    if method in BOX_SIZES or method == 'box':
+        size = BOX_SIZES.get(method) or int(sigma_input)
+        if backend == 'fast':
+            return box_filter_sat(frames_array, size, dtype)
+        return uniform_filter(frames_array.astype(dtype), size=(1,) * n_lead + (size, size))
+    if method == 'gaussian':
+        if backend == 'fast' and sigma_input >= RECURSIVE_GAUSSIAN_MIN_SIGMA:
+            return recursive_gaussian_filter(frames_array, sigma_input, dtype)
+        return gaussian_filter(frames_array.astype(dtype), sigma=(0,) * n_lead + (sigma_input, sigma_input))
+    raise ValueError(f"Unknown spatial method: {method}")
+
+
+def smooth_frame(frame, method, sigma_input=None, dtype=float):
+    """
+    Apply the 2D spatial smoothing of apply_spatial_smoothing to a single frame.
+    method=None returns the frame unsmoothed.
+    """
+    if method is None:
+        return np.asarray(frame).astype(dtype)
+    return apply_spatial_smoothing(frame, method, sigma_input, dtype)
+
+
+@profiled()
+def spatio_temporal_derivative(frames_array, index, spatial_method, spatial_param,
+                               temporal_method, temporal_sigma=None, dtype=float):
+    """
+    Fused spatial smoothing + temporal derivative at frame[index].
+    Both filters are linear, so the temporal kernel is applied first to the 2*margin+1
+    frames around index and the spatial kernel only once to the result. This matches
+    smoothing the whole sequence and then differentiating, at a cost that depends on the
+    kernel support instead of the sequence length.
+    """
+    weights = temporal_derivative_kernel(temporal_method, temporal_sigma).astype(dtype)
+    margin = len(weights) // 2
+    if index < margin or index >= len(frames_array) - margin:
+        return None
+    combined = np.zeros(np.shape(frames_array[index]), dtype=dtype)
+    for j, w in enumerate(weights):
+        if w != 0:
+            combined += w * np.asarray(frames_array[index - margin + j], dtype=dtype)
+    return smooth_frame(combined, spatial_method, spatial_param, dtype)
+
+
+def spatio_temporal_derivatives(frames_array, indices, spatial_method, spatial_param,
+                                temporal_method, temporal_sigma=None, dtype=float):
+    """
+    Fused derivatives for a sparse set of frames, returned as {index: derivative}.
+    Frames without full temporal support are omitted.
+    """
+    derivs = {}
+    for index in indices:
+        deriv = spatio_temporal_derivative(frames_array, index, spatial_method, spatial_param,
+                                           temporal_method, temporal_sigma, dtype)
+        if deriv is not None:
+            derivs[index] = deriv
+    return derivs
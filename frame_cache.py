@@ -0,0 +1,157 @@
+import contextlib
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+from frame_source import list_frame_files
+
+
+MANIFEST_NAME = 'manifest.json'
+FRAMES_NAME = 'frames.npy'
+LOCK_NAME = '.lock'
+
+
+def _decode_uint8(image_path):
+    return np.array(Image.open(image_path).convert("L"), dtype=np.uint8)
+
+
+def _source_entries(frame_files):
+    entries = []
+    for image_path in frame_files:
+        st = os.stat(image_path)
+        entries.append({'name': os.path.basename(image_path),
+                        'mtime_ns': st.st_mtime_ns, 'size': st.st_size})
+    return entries
+
+
+def frame_cache_path(image_dir, cache_dir):
+    """
+    Directory holding the decoded cache of image_dir inside cache_dir.
+    """
+    key = hashlib.sha1(os.path.abspath(image_dir).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, key)
+
+
+@contextlib.contextmanager
+def _build_lock(out_dir):
+    # Serializes builds of one cache across processes (e.g. batch workers sharing an
+    # image_dir); without fcntl the builds are not serialized
+    os.makedirs(out_dir, exist_ok=True)
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(out_dir, LOCK_NAME), 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def build_frame_cache(image_dir, cache_dir, workers=None):
+    """
+    Decode every frame of image_dir in parallel into a uint8 (T, H, W) .npy file plus a
+    manifest of source file names, mtimes, sizes and the array shape.
+    Builds of the same cache by other processes wait for this one (file lock).
+    """
+    frame_files = list_frame_files(image_dir)
+    if not frame_files:
+        raise ValueError(f"No frames found in {image_dir}")
+    out_dir = frame_cache_path(image_dir, cache_dir)
+    with _build_lock(out_dir):
+        return _build_frame_cache(frame_files, image_dir, out_dir, workers)
+
+
+def _build_frame_cache(frame_files, image_dir, out_dir, workers):
+    manifest_path = os.path.join(out_dir, MANIFEST_NAME)
+    frames_path = os.path.join(out_dir, FRAMES_NAME)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    entries = _source_entries(frame_files)
+    first = _decode_uint8(frame_files[0])
+    shape = (len(frame_files),) + first.shape
+    # Named per process, so a build that does not hold the lock (no fcntl) cannot clash
+    tmp_path = f'{frames_path}.{os.getpid()}.tmp.npy'
+    frames = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.uint8, shape=shape)
+    try:
+        frames[0] = first
+        # PIL releases the GIL while decoding, so threads avoid pickling the frames
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for i, frame in enumerate(pool.map(_decode_uint8, frame_files[1:]), start=1):
+                if frame.shape != first.shape:
+                    raise ValueError(f"Frame {frame_files[i]} has shape {frame.shape}, "
+                                     f"expected {first.shape}")
+                frames[i] = frame
+        frames.flush()
+    except BaseException:
+        del frames
+        os.remove(tmp_path)
+        raise
+    del frames
+    os.replace(tmp_path, frames_path)
+
+    # The manifest is written last so an interrupted build is never treated as valid
+    manifest = {'image_dir': os.path.abspath(image_dir), 'shape': list(shape),
+                'dtype': 'uint8', 'files': entries}
+    tmp_manifest = f'{manifest_path}.{os.getpid()}.tmp'
+    with open(tmp_manifest, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_manifest, manifest_path)
+    return frames_path
+
+
+def is_frame_cache_valid(image_dir, cache_dir):
+    """
+    True if the cache exists and every source file still has the recorded mtime and size.
+    """
+    out_dir = frame_cache_path(image_dir, cache_dir)
+    manifest_path = os.path.join(out_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path) or not os.path.exists(os.path.join(out_dir, FRAMES_NAME)):
+        return False
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    return manifest['files'] == _source_entries(list_frame_files(image_dir))
+
+
+def ensure_frame_cache(image_dir, cache_dir, workers=None):
+    """
+    Build the cache of image_dir unless it is valid. Processes needing the same cache
+    build it once: the others wait for the lock and then find it valid.
+    Returns the path of the frames file.
+    """
+    out_dir = frame_cache_path(image_dir, cache_dir)
+    if not is_frame_cache_valid(image_dir, cache_dir):
+        frame_files = list_frame_files(image_dir)
+        if not frame_files:
+            raise ValueError(f"No frames found in {image_dir}")
+        with _build_lock(out_dir):
+            if not is_frame_cache_valid(image_dir, cache_dir):
+                _build_frame_cache(frame_files, image_dir, out_dir, workers)
+    return os.path.join(out_dir, FRAMES_NAME)
+
+
+def open_frame_cache(image_dir, cache_dir, workers=None):
+    """
+    Return the decoded frames of image_dir as a read-only uint8 memmap, rebuilding the
+    cache first if it is missing or any source file changed.
+    """
+    return np.load(ensure_frame_cache(image_dir, cache_dir, workers), mmap_mode='r')
+
+
+def load_cached_frame_window(image_dir, center, margin, cache_dir, workers=None, dtype=float):
+    """
+    Cached counterpart of frame_source.load_frame_window.
+    """
+    frames = open_frame_cache(image_dir, cache_dir, workers)
+    start = max(0, center - margin)
+    stop = min(len(frames), center + margin + 1)
+    return np.array(frames[start:stop], dtype=dtype), start
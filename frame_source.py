@@ -0,0 +1,91 @@
+import os
+import numpy as np
+from PIL import Image
+
+from profiling import profiled
+
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def list_frame_files(image_dir):
+    """
+    Return the sorted paths of all frame images in image_dir.
+    """
+    return [os.path.join(image_dir, f) for f in sorted(os.listdir(image_dir))
+            if f.endswith(IMAGE_EXTENSIONS)]
+
+
+@profiled()
+def load_frame(image_path, dtype=float):
+    """
+    Decode a single frame as a grayscale array (float by default, uint8 keeps raw values).
+    """
+    image = Image.open(image_path)
+    return np.array(image.convert("L"), dtype=dtype)
+
+
+def iter_frames(image_dir, start=0, stop=None, dtype=float):
+    """
+    Lazily yield the frames of image_dir in order, decoding one file at a time.
+    """
+    for image_path in list_frame_files(image_dir)[start:stop]:
+        yield load_frame(image_path, dtype)
+
+
+def load_frame_window(image_dir, center, margin, dtype=float):
+    """
+    Load only the frames within `margin` of frame `center`, clipped to the sequence.
+    Returns the (N, H, W) window and the absolute index of its first frame.
+    """
+    n_frames = len(list_frame_files(image_dir))
+    start = max(0, center - margin)
+    stop = min(n_frames, center + margin + 1)
+    buffer = FrameRingBuffer(stop - start)
+    for frame in iter_frames(image_dir, start, stop, dtype):
+        buffer.append(frame)
+    return buffer.window(), start
+
+
+class FrameRingBuffer:
+    """
+    Fixed-capacity buffer holding the most recent frames of a stream.
+    Frames are addressed by their absolute index in the stream and len() is the number
+    of frames seen so far, so the temporal filters in filters.py can index it like a
+    full sequence as long as the requested frames are still retained.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._frames = None
+        self._count = 0
+
+    def append(self, frame):
+        frame = np.asarray(frame)
+        if self._frames is None:
+            self._frames = np.empty((self.capacity,) + frame.shape, dtype=frame.dtype)
+        self._frames[self._count % self.capacity] = frame
+        self._count += 1
+
+    @property
+    def start(self):
+        """Absolute index of the oldest retained frame."""
+        return max(0, self._count - self.capacity)
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._count)
+            return np.array([self[i] for i in range(start, stop, step)])
+        if index < 0:
+            index += self._count
+        if index < self.start or index >= self._count:
+            raise IndexError(f"Frame {index} is not in the buffer "
+                             f"(retained frames {self.start}..{self._count - 1})")
+        return self._frames[index % self.capacity]
+
+    def window(self):
+        """Return the retained frames in temporal order as one (N, H, W) array."""
+        return self[self.start:self._count]
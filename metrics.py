@@ -1,19 +1,33 @@
 import numpy as np
 from scipy.ndimage import label
 
+import profiling
+from profiling import profiled
+from thresholds import percentile_values, noise_sigma_from_abs
 
+
+@profiled()
 def compute_derivative_snr(derivative):
     """
     Estimate signal-to-noise ratio of the temporal derivative.
     """
     abs_d = np.abs(derivative).ravel()
-    fg_vals = abs_d[abs_d >= np.percentile(abs_d, 95)]
-    bg_vals = abs_d[abs_d <= np.percentile(abs_d, 50)]
-    if len(bg_vals) == 0 or np.std(bg_vals) == 0:
+    return _snr_from_abs(abs_d, np.percentile(abs_d, 50), np.percentile(abs_d, 95))
+
+
+def _snr_from_abs(abs_d, p50, p95):
+    fg_vals = abs_d[abs_d >= p95]
+    bg_vals = abs_d[abs_d <= p50]
+    if len(bg_vals) == 0:
         return 0.0
-    return np.mean(fg_vals) / (np.std(bg_vals) + 1e-8)
+    # Accumulate in float64 so reduced-precision derivatives give the same statistics
+    bg_std = np.std(bg_vals, dtype=np.float64)
+    if bg_std == 0:
+        return 0.0
+    return np.mean(fg_vals, dtype=np.float64) / (bg_std + 1e-8)
 
 
+@profiled()
 def compute_largest_component_ratio(mask):
     """
     Measure spatial coherence of the motion mask.
@@ -28,3 +42,170 @@ def compute_largest_component_ratio(mask):
         return 0.0
     return sizes.max() / total
 
+
+def _find_roots(parent, nodes):
+    # Vectorized union-find lookup with path compression of the queried nodes
+    roots = parent[nodes]
+    while True:
+        up = parent[roots]
+        if np.array_equal(up, roots):
+            break
+        roots = up
+    parent[nodes] = roots
+    return roots
+
+
+def _connect(n_nodes, a, b):
+    # Connected components of a small graph given as edge arrays: every node ends up
+    # pointing at the smallest node of its component (hook roots onto the smaller
+    # neighbouring root, then pointer-jump, until nothing changes)
+    comp = np.arange(n_nodes)
+    while True:
+        root_a, root_b = comp[a], comp[b]
+        low = np.minimum(root_a, root_b)
+        hooked = comp.copy()
+        np.minimum.at(hooked, root_a, low)
+        np.minimum.at(hooked, root_b, low)
+        while True:
+            jumped = hooked[hooked]
+            if np.array_equal(jumped, hooked):
+                break
+            hooked = jumped
+        if np.array_equal(hooked, comp):
+            return comp
+        comp = hooked
+
+
+@profiled()
+def largest_component_sweep(derivative, thresholds):
+    """
+    Largest-component ratio, component count and motion % of the mask |derivative| > t
+    for every threshold t, from one incremental pass over the thresholds.
+    Each pixel belongs to the band of the highest threshold it exceeds, and each pair of
+    4-neighbours (the connectivity used by label) to the band where its second pixel
+    appears. Bands are added in descending threshold order: the band's pixels and the
+    components its neighbour pairs touch are merged as one small graph, and a union-find
+    over the component roots carries the result to the next band. The whole-frame work is
+    one pass assigning bands and neighbour pairs, a few labelings' worth; each band then
+    costs in proportion to its own pixels.
+    Returns a dict of arrays aligned with `thresholds`.
+    """
+    abs_d = np.abs(derivative)
+    width = abs_d.shape[1]
+    thresholds = np.asarray(thresholds, dtype=float)
+    n_thr = len(thresholds)
+    n_total = abs_d.size
+    lcc = np.zeros(n_thr)
+    num_components = np.zeros(n_thr, dtype=int)
+    motion_pct = np.zeros(n_thr)
+    if n_thr == 0:
+        return {'lcc': lcc, 'num_components': num_components, 'motion_pct': motion_pct}
+
+    descending = np.argsort(-thresholds, kind='stable')
+    active = abs_d > thresholds.min()
+    flat_active = np.flatnonzero(active)
+    # band = number of thresholds >= |d|, i.e. the position (in descending order) of the
+    # first threshold the pixel exceeds. Active pixels get ids in band order, so each
+    # band is a contiguous range of ids.
+    band = n_thr - np.searchsorted(np.sort(thresholds), abs_d.ravel()[flat_active], side='left')
+    by_band = np.argsort(band, kind='stable')
+    pixel_splits = np.searchsorted(band[by_band], np.arange(n_thr + 1), side='left')
+    ids = np.empty(n_total, dtype=np.intp)
+    ids[flat_active[by_band]] = np.arange(flat_active.size)
+
+    # 4-neighbour pairs of active pixels; a pair joins in the band of its later pixel,
+    # i.e. that of its larger id
+    right = np.flatnonzero(active[:, :-1] & active[:, 1:])
+    right += right // max(width - 1, 1)
+    down = np.flatnonzero(active[:-1] & active[1:])
+    edge_u = ids[np.concatenate([right, down])]
+    edge_v = ids[np.concatenate([right + 1, down + width])]
+    edge_key = np.maximum(edge_u, edge_v)
+    edge_order = np.argsort(edge_key, kind='stable')
+    edge_u, edge_v = edge_u[edge_order], edge_v[edge_order]
+    edge_splits = np.searchsorted(edge_key[edge_order], pixel_splits, side='left')
+
+    parent = np.arange(flat_active.size)
+    size = np.zeros(flat_active.size, dtype=np.int64)
+    n_components = 0
+    largest = 0
+    for j in range(n_thr):
+        new = np.arange(pixel_splits[j], pixel_splits[j + 1])
+        size[new] = 1
+        u = edge_u[edge_splits[j]:edge_splits[j + 1]]
+        v = edge_v[edge_splits[j]:edge_splits[j + 1]]
+        if u.size:
+            n_edges = u.size
+            nodes, inverse = np.unique(np.concatenate([_find_roots(parent, u), _find_roots(parent, v), new]),
+                                       return_inverse=True)
+            component = _connect(nodes.size, inverse[:n_edges], inverse[n_edges:2 * n_edges])
+            merged_size = np.bincount(component, weights=size[nodes], minlength=nodes.size).astype(np.int64)
+            is_root = component == np.arange(nodes.size)
+            parent[nodes] = nodes[component]
+            size[nodes[is_root]] = merged_size[is_root]
+            largest = max(largest, int(merged_size.max()))
+            n_components += new.size - (nodes.size - np.count_nonzero(is_root))
+        elif new.size:
+            largest = max(largest, 1)
+            n_components += new.size
+        t_idx = descending[j]
+        added = pixel_splits[j + 1]
+        num_components[t_idx] = n_components
+        lcc[t_idx] = largest / added if added else 0.0
+        motion_pct[t_idx] = 100 * added / n_total
+    return {'lcc': lcc, 'num_components': num_components, 'motion_pct': motion_pct}
+
+
+@profiled()
+def analyze_derivative(derivative, strategies, percentile_method='exact', noise_method='exact',
+                       lcc_method='label'):
+    """
+    Threshold, mask, motion %, SNR and LCC for several threshold strategies at once.
+    strategies is a list of (kind, param) with kind 'fixed' (param = threshold value),
+    'percentile' (param = percentile) or 'noise' (param = k). |derivative| is computed
+    once, and the SNR percentiles, the noise-model median and every exact percentile
+    threshold come from a single partition. With percentile_method='histogram' the SNR
+    percentiles and the thresholds come from a single histogram instead (to one bin width);
+    the SNR then splits the pixels at the edges of the p50 / p95 bins, which keeps repeated
+    values (derivatives of integer frames) on the same side as with the exact percentiles.
+    lcc_method='sweep' evaluates the LCC of all
+    masks with largest_component_sweep instead of labeling each mask.
+    Returns (snr, results) where results holds one dict per strategy, in order.
+    """
+    abs_d = np.abs(derivative)
+    pcts = [param for kind, param in strategies if kind == 'percentile']
+    with profiling.stage('metrics.analyze_derivative.percentiles'):
+        stats, lower, upper = percentile_values(abs_d, [50, 95] + pcts, percentile_method, bin_edges=True)
+        p50, pct_thrs = stats[0], list(stats[2:])
+    snr = _snr_from_abs(abs_d.ravel(), upper[0], lower[1])
+
+    sigma_noise = None
+    if any(kind == 'noise' for kind, _ in strategies):
+        # p50 is the median the noise model would select when both use the same method
+        same_median = noise_method == percentile_method
+        sigma_noise = noise_sigma_from_abs(abs_d, noise_method, median=p50 if same_median else None)
+
+    thresholds = []
+    for kind, param in strategies:
+        if kind == 'fixed':
+            thresholds.append(param)
+        elif kind == 'percentile':
+            thresholds.append(pct_thrs.pop(0))
+        elif kind == 'noise':
+            thresholds.append(param * sigma_noise)
+        else:
+            raise ValueError(f"Unknown threshold strategy: {kind}")
+
+    if lcc_method == 'sweep' and thresholds:
+        lccs = largest_component_sweep(abs_d, thresholds)['lcc']
+    results = []
+    for i, ((kind, param), thr) in enumerate(zip(strategies, thresholds)):
+        mask = (abs_d > thr).astype(np.uint8)
+        results.append({
+            'strategy': kind, 'param': param, 'threshold': thr, 'mask': mask,
+            'motion_pct': 100 * np.count_nonzero(mask) / mask.size,
+            'lcc': lccs[i] if lcc_method == 'sweep' else compute_largest_component_ratio(mask),
+            'sigma_noise': sigma_noise if kind == 'noise' else None,
+        })
+    return snr, results
+
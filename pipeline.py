@@ -0,0 +1,245 @@
+import os
+import numpy as np
+
+from metrics import analyze_derivative
+from filters import temporal_margin, PRECISION_DTYPES
+from compute_cache import ComputeCache, cached_spatial_smoothing, cached_temporal_derivative
+from frame_source import list_frame_files, load_frame_window
+from frame_cache import load_cached_frame_window
+from sweep import run_sweep
+from results_store import ResultsStore
+import profiling
+from profiling import profiled
+import config
+
+# Importing this module does no work: frames are only read and matplotlib is only
+# imported (inside render_figures) when the functions below are called.
+
+
+@profiled()
+def load_frames(cfg=config):
+    """
+    Load the frames needed around the middle frame of cfg.IMAGE_DIR.
+    Only the frames inside the widest temporal kernel are decoded, so memory does not grow
+    with the sequence length. Returns (frames_array, test_frame_idx, window_start) where
+    test_frame_idx is relative to the window and window_start is its absolute first frame.
+    """
+    frame_dtype, _ = PRECISION_DTYPES[cfg.PRECISION]
+    n_frames = len(list_frame_files(cfg.IMAGE_DIR))
+    max_margin = max([temporal_margin('simple')] +
+                     [temporal_margin('gaussian', s) for s in cfg.TEMPORAL_SIGMA_VALUES] +
+                     [temporal_margin(m, p) for _, m, p in cfg.TEMPORAL_CONFIGS])
+    if cfg.FRAME_CACHE_DIR:
+        frames_array, window_start = load_cached_frame_window(cfg.IMAGE_DIR, n_frames // 2, max_margin,
+                                                              cfg.FRAME_CACHE_DIR, cfg.FRAME_CACHE_WORKERS,
+                                                              dtype=frame_dtype)
+    else:
+        frames_array, window_start = load_frame_window(cfg.IMAGE_DIR, n_frames // 2, max_margin, dtype=frame_dtype)
+    return frames_array, n_frames // 2 - window_start, window_start
+
+
+def make_cache(cfg=config):
+    """
+    Compute cache shared by all the steps, so smoothed volumes and derivatives are computed once.
+    """
+    return ComputeCache(cfg.COMPUTE_CACHE_MAX_BYTES, cfg.COMPUTE_CACHE_DIR, cfg.COMPUTE_CACHE_DIR_MAX_BYTES)
+
+
+@profiled()
+def temporal_derivatives(frames_array, test_frame_idx, cache, cfg=config):
+    """
+    Temporal derivatives (no spatial smoothing) of the test frame for the simple filter and
+    every DoG sigma in cfg.TEMPORAL_SIGMA_VALUES.
+    Returns {filter name: {'derivative', 'frame_range'}}; filters that do not fit are skipped.
+    """
+    _, work_dtype = PRECISION_DTYPES[cfg.PRECISION]
+    raw = {}
+    deriv = cached_temporal_derivative(cache, frames_array, test_frame_idx, 'simple', dtype=work_dtype)
+    if deriv is not None:
+        raw['Simple [-1,0,1]'] = {
+            'derivative': deriv,
+            'frame_range': (test_frame_idx - 1, test_frame_idx + 1),
+        }
+    for t_sigma in cfg.TEMPORAL_SIGMA_VALUES:
+        deriv = cached_temporal_derivative(cache, frames_array, test_frame_idx, 'gaussian', t_sigma, dtype=work_dtype)
+        if deriv is not None:
+            margin = int(np.ceil(3 * t_sigma))  # margin needed for gaussian filter
+            raw[f'DoG ts={t_sigma}'] = {
+                'derivative': deriv,
+                'frame_range': (test_frame_idx - margin, test_frame_idx + margin),
+            }
+    return raw
+
+
+@profiled()
+def evaluate_temporal_derivatives(raw_derivatives, cfg=config):
+    """
+    Threshold each raw temporal derivative at every percentile in cfg.PERCENTILE_VALUES.
+    Returns a ResultsStore keyed by "<filter> | p=<percentile>".
+    """
+    results = ResultsStore()
+    for t_name, t_data in raw_derivatives.items():
+        d = t_data['derivative']
+        with profiling.configuration(t_name):
+            snr, analysis = analyze_derivative(d, [('percentile', pct) for pct in cfg.PERCENTILE_VALUES],
+                                               percentile_method=cfg.PERCENTILE_METHOD)
+        for pct, res in zip(cfg.PERCENTILE_VALUES, analysis):
+            key = f"{t_name} | p={pct}"
+            results.add(
+                key, mask=res['mask'], arrays={'derivative': d}, threshold=res['threshold'],
+                percentile=pct, motion_pct=res['motion_pct'], snr=snr, lcc=res['lcc'],
+                frame_range=t_data['frame_range'], filter_name=t_name,
+            )
+    return results
+
+
+@profiled()
+def evaluate_spatial_temporal(frames_array, test_frame_idx, cache, cfg=config):
+    """
+    Sweep every spatial filter x temporal filter x percentile combination.
+    Returns a ResultsStore keyed by "<spatial> + <temporal> | p=<percentile>". The smoothed
+    frames of each spatial filter are attached as a lazy array (computed on first access).
+    """
+    _, work_dtype = PRECISION_DTYPES[cfg.PRECISION]
+    rows = run_sweep(frames_array, test_frame_idx, cfg.SPATIAL_CONFIGS, cfg.TEMPORAL_CONFIGS, cfg.PERCENTILE_VALUES,
+                     workers=cfg.SWEEP_WORKERS, dtype=work_dtype, backend=cfg.SPATIAL_BACKEND,
+                     percentile_method=cfg.PERCENTILE_METHOD, return_arrays=True, cache=cache)
+
+    results = ResultsStore()
+    spatial_params = {s_name: (s_method, s_param) for s_name, s_method, s_param in cfg.SPATIAL_CONFIGS}
+    for row in rows:
+        s_method, s_param = spatial_params[row['spatial']]
+        load_smoothed = lambda m=s_method, p=s_param: cached_spatial_smoothing(
+            cache, frames_array, m, p, dtype=work_dtype, backend=cfg.SPATIAL_BACKEND)
+        combo_key = f"{row['spatial']} + {row['temporal']} | p={row['percentile']}"
+        mask = row.pop('mask')
+        arrays = {'derivative': row.pop('derivative'), 'smoothed_frames': load_smoothed}
+        results.add(combo_key, mask=mask, arrays=arrays, test_frame_idx=test_frame_idx, **row)
+    return results
+
+
+@profiled()
+def threshold_strategies(derivative, cfg=config):
+    """
+    Compare the fixed, percentile and noise-model threshold strategies on one derivative.
+    Returns (snr, analysis) as given by metrics.analyze_derivative.
+    """
+    strategies = ([('fixed', val) for val in [2, 5, 10, 20, 30]] +
+                  [('percentile', pct) for pct in cfg.PERCENTILE_VALUES] +
+                  [('noise', k) for k in [2, 3, 4, 5]])
+    return analyze_derivative(derivative, strategies, percentile_method=cfg.PERCENTILE_METHOD,
+                              noise_method=cfg.NOISE_METHOD)
+
+
+@profiled()
+def render_figures(results, cfg=config):
+    """
+    Save every figure for the output of run() with cfg.RENDER_BACKEND.
+    matplotlib is imported only when a figure is drawn with it, not at module load.
+    """
+    from visualize_temporal_derivatives_only import visualize_temporal_derivatives_only_main, visualize_temporal_derivatives_only_percentile_comparison
+    from visualize_spatial_temporal_combined import visualize_spatial_temporal_combined_main, visualize_spatial_temporal_combined_percentile_comparison
+    from visualize_threshold_analysis import visualize_threshold_analysis_fixed_thresholds, visualize_threshold_analysis_noise_model, visualize_threshold_analysis_strategy_comparison
+
+    _, work_dtype = PRECISION_DTYPES[cfg.PRECISION]
+    frames_array = results['frames']
+    test_frame_idx = results['test_frame_idx']
+    window_start = results['window_start']
+    percentile_values = cfg.PERCENTILE_VALUES
+    render = {'render_backend': cfg.RENDER_BACKEND, 'workers': cfg.RENDER_WORKERS,
+              'skip_unchanged': cfg.RENDER_SKIP_UNCHANGED}
+
+    # Temporal Derivatives (No Spatial Smoothing)
+    visualize_temporal_derivatives_only_main(results['temporal'], frames_array, test_frame_idx, cfg.RESULTS_TEMPORAL_DERIVATIVES_ONLY_DIR,
+                                             frame_offset=window_start, **render)
+    visualize_temporal_derivatives_only_percentile_comparison(results['raw_temporal'], frames_array, test_frame_idx,
+                                         percentile_values, cfg.RESULTS_TEMPORAL_DERIVATIVES_ONLY_DIR,
+                                         percentile_method=cfg.PERCENTILE_METHOD, **render)
+
+    # Spatial Smoothing + Temporal Derivatives
+    visualize_spatial_temporal_combined_main(results['spatial_temporal'], cfg.SPATIAL_CONFIGS, frames_array, test_frame_idx, cfg.RESULTS_SPATIAL_TEMPORAL_COMBINED_DIR,
+                                             frame_offset=window_start, **render)
+    visualize_spatial_temporal_combined_percentile_comparison(cfg.SPATIAL_CONFIGS, cfg.TEMPORAL_CONFIGS, frames_array,
+                                         frames_array, test_frame_idx, percentile_values, cfg.RESULTS_SPATIAL_TEMPORAL_COMBINED_DIR,
+                                         dtype=work_dtype, cache=results['cache'], backend=cfg.SPATIAL_BACKEND,
+                                         percentile_method=cfg.PERCENTILE_METHOD, **render)
+
+    # Threshold Analysis & Adaptive Strategy
+    test_derivatives = results['test_derivatives']
+    visualize_threshold_analysis_fixed_thresholds(test_derivatives, frames_array, test_frame_idx,
+                                     cfg.FIXED_THRESHOLDS, cfg.RESULTS_THRESHOLD_ANALYSIS_DIR, **render)
+    visualize_threshold_analysis_noise_model(test_derivatives, frames_array, test_frame_idx,
+                               cfg.K_VALUES, cfg.RESULTS_THRESHOLD_ANALYSIS_DIR,
+                               noise_method=cfg.NOISE_METHOD, **render)
+    visualize_threshold_analysis_strategy_comparison(test_derivatives, frames_array, test_frame_idx,
+                                       percentile_values, cfg.RESULTS_THRESHOLD_ANALYSIS_DIR,
+                                       percentile_method=cfg.PERCENTILE_METHOD, noise_method=cfg.NOISE_METHOD, **render)
+
+
+def run(cfg=config, figures=True):
+    """
+    Run the whole analysis: load -> filter -> threshold -> metrics, then optionally the figures.
+    Returns a dict with the frames, the two ResultsStores ('temporal', 'spatial_temporal')
+    and the threshold strategy comparison ('strategy_snr', 'strategies').
+    """
+    frames_array, test_frame_idx, window_start = load_frames(cfg)
+    cache = make_cache(cfg)
+
+    os.makedirs(cfg.RESULTS_TEMPORAL_DERIVATIVES_ONLY_DIR, exist_ok=True)
+    os.makedirs(cfg.RESULTS_SPATIAL_TEMPORAL_COMBINED_DIR, exist_ok=True)
+    os.makedirs(cfg.RESULTS_THRESHOLD_ANALYSIS_DIR, exist_ok=True)
+
+    raw_temporal = temporal_derivatives(frames_array, test_frame_idx, cache, cfg)
+    results_temporal = evaluate_temporal_derivatives(raw_temporal, cfg)
+    if cfg.SAVE_RESULTS_STORE:
+        with profiling.stage('results_store.save'):
+            results_temporal.save(os.path.join(cfg.RESULTS_TEMPORAL_DERIVATIVES_ONLY_DIR, 'store'))
+
+    results_spatial_temporal = evaluate_spatial_temporal(frames_array, test_frame_idx, cache, cfg)
+    if cfg.SAVE_RESULTS_STORE:
+        with profiling.stage('results_store.save'):
+            results_spatial_temporal.save(os.path.join(cfg.RESULTS_SPATIAL_TEMPORAL_COMBINED_DIR, 'store'))
+
+    test_derivatives = {name: data['derivative'] for name, data in raw_temporal.items()}
+    strategy_snr, strategies = threshold_strategies(test_derivatives['Simple [-1,0,1]'], cfg)
+
+    results = {
+        'frames': frames_array,
+        'test_frame_idx': test_frame_idx,
+        'window_start': window_start,
+        'cache': cache,
+        'raw_temporal': raw_temporal,
+        'temporal': results_temporal,
+        'spatial_temporal': results_spatial_temporal,
+        'test_derivatives': test_derivatives,
+        'strategy_snr': strategy_snr,
+        'strategies': strategies,
+    }
+    if figures:
+        render_figures(results, cfg)
+    return results
+
+
+def print_tables(results):
+    """
+    Print the summary tables for the output of run().
+    """
+    print("TABLE 1")
+    print(f"{'Filter':<25} {'Pctl':>5} {'Thr':>8} {'Motion%':>9} {'SNR':>8} {'LCC':>8}")
+    for name, res in results['temporal'].items():
+        print(f"{res['filter_name']:<25} {res['percentile']:>5} {res['threshold']:>8.2f} "
+              f"{res['motion_pct']:>8.2f}% {res['snr']:>8.2f} {res['lcc']:>8.3f}")
+
+    print("TABLE 2")
+    print(f"{'Spatial':<15} {'Temporal':<20} {'Pctl':>5} {'Thr':>8} {'Motion%':>9} {'SNR':>8} {'LCC':>8}")
+    for name, res in results['spatial_temporal'].items():
+        print(f"{res['spatial']:<15} {res['temporal']:<20} {res['percentile']:>5} "
+              f"{res['threshold']:>8.2f} {res['motion_pct']:>8.2f}% {res['snr']:>8.2f} {res['lcc']:>8.3f}")
+
+    print("THRESHOLD STRATEGY COMPARISON (Simple [-1,0,1])")
+    print(f"{'Strategy':<15} {'Param':<8} {'Thr':>10} {'Motion%':>10} {'SNR':>10} {'LCC':>10}")
+    strategy_labels = {'fixed': 'Fixed', 'percentile': 'Percentile', 'noise': 'Noise model'}
+    for res in results['strategies']:
+        param = 'k=' + str(res['param']) if res['strategy'] == 'noise' else res['param']
+        print(f"{strategy_labels[res['strategy']]:<15} {param:<8} {res['threshold']:>10.2f} {res['motion_pct']:>9.2f}% "
+              f"{results['strategy_snr']:>10.2f} {res['lcc']:>10.3f}")
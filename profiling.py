@@ -0,0 +1,277 @@
+import csv
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+# Profiling is off unless enable() is called; the hooks below then cost one flag check
+_enabled = False
+_memory = False
+_t0 = 0.0
+_events = []
+_lock = threading.Lock()
+_local = threading.local()
+# tracemalloc counts the whole process: threads with an open stage, and a counter bumped
+# whenever the stages of two threads overlap (their memory is then not attributed)
+_memory_threads = 0
+_memory_overlaps = 0
+
+# ru_maxrss is in KiB on Linux (bytes on macOS)
+_RSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+
+class _Null:
+    # Shared no-op context returned while profiling is disabled
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL = _Null()
+
+
+def enable(memory=False):
+    """
+    Start recording stages, discarding earlier events. With memory=True tracemalloc
+    traces allocations, so each stage also records the bytes it allocated and its peak
+    (at a noticeable cost in speed). tracemalloc's counters are process-wide, so a stage
+    gets memory columns only when no other thread ran stages while it was open; under the
+    threaded video pipeline or the PIL render workers, profile memory with them serial.
+    """
+    global _enabled, _memory, _t0, _memory_threads, _memory_overlaps
+    _events.clear()
+    _memory_threads = _memory_overlaps = 0
+    _memory = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _t0 = time.perf_counter()
+    _enabled = True
+
+
+def disable():
+    """
+    Stop recording (the events are kept until the next enable()).
+    """
+    global _enabled
+    _enabled = False
+    if _memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def is_enabled():
+    return _enabled
+
+
+def _stack(name):
+    stack = getattr(_local, name, None)
+    if stack is None:
+        stack = []
+        setattr(_local, name, stack)
+    return stack
+
+
+class _Stage:
+
+    def __init__(self, name, config):
+        self.name = name
+        self.config = config
+
+    def __enter__(self):
+        global _memory_threads, _memory_overlaps
+        configs = _stack('configs')
+        if self.config is None:
+            self.config = configs[-1] if configs else ''
+        if _memory:
+            with _lock:
+                if not _stack('stages'):
+                    _memory_threads += 1
+                if _memory_threads > 1:
+                    _memory_overlaps += 1
+                self._overlaps = _memory_overlaps
+                self._shared = _memory_threads > 1
+            current, peak = tracemalloc.get_traced_memory()
+            # Each stage resets the peak, so the peak reached so far is kept on the enclosing
+            # stage, which folds it back in when it exits
+            stages = _stack('stages')
+            if stages:
+                stages[-1]._child_peak = max(stages[-1]._child_peak, peak)
+            tracemalloc.reset_peak()
+            self._mem_start = current
+            self._child_peak = 0
+            stages.append(self)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        global _memory_threads
+        end = time.perf_counter()
+        event = {'name': self.name, 'config': self.config, 'thread': threading.current_thread().name,
+                 'start': self._start - _t0, 'seconds': end - self._start}
+        if _memory:
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(peak, self._child_peak)
+            stages = _stack('stages')
+            stages.pop()
+            if stages:
+                stages[-1]._child_peak = max(stages[-1]._child_peak, peak)
+            with _lock:
+                alone = not self._shared and _memory_overlaps == self._overlaps
+                if not stages:
+                    _memory_threads -= 1
+            if alone:
+                event['alloc_bytes'] = current - self._mem_start
+                event['peak_bytes'] = max(0, peak - self._mem_start)
+        if resource is not None:
+            event['max_rss_bytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _RSS_UNIT
+        with _lock:
+            _events.append(event)
+        return False
+
+
+def stage(name, config=None):
+    """
+    Context manager timing the enclosed block as stage `name`. config labels the
+    configuration it belongs to (default: the innermost configuration() label).
+    Returns a shared no-op context while profiling is disabled.
+    """
+    if not _enabled:
+        return _NULL
+    return _Stage(name, config)
+
+
+def profiled(name=None):
+    """
+    Decorator recording every call of a function as a stage (named module.function by default).
+    """
+    def decorate(fn):
+        stage_name = name or f'{fn.__module__}.{fn.__qualname__}'
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _Stage(stage_name, None):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+class _Configuration:
+
+    def __init__(self, label):
+        self.label = label
+
+    def __enter__(self):
+        _stack('configs').append(self.label)
+        return self
+
+    def __exit__(self, *exc):
+        _stack('configs').pop()
+        return False
+
+
+def configuration(label):
+    """
+    Context manager attributing the stages recorded inside it (on this thread) to the
+    configuration `label`, e.g. one spatial + temporal filter pair of the sweep.
+    """
+    if not _enabled:
+        return _NULL
+    return _Configuration(label)
+
+
+def events():
+    """
+    The recorded stage events, in completion order. Times are in seconds since enable();
+    nested stages are included in the time of the stages enclosing them.
+    """
+    with _lock:
+        return list(_events)
+
+
+def summary():
+    """
+    Events aggregated per (stage, configuration): call count, total / mean / max seconds,
+    allocated bytes, largest peak and the process peak RSS seen at the end of the stage.
+    """
+    rows = {}
+    for e in events():
+        key = (e['name'], e['config'])
+        row = rows.get(key)
+        if row is None:
+            row = rows[key] = {'name': e['name'], 'config': e['config'], 'calls': 0, 'total_s': 0.0,
+                               'max_s': 0.0}
+        row['calls'] += 1
+        row['total_s'] += e['seconds']
+        row['max_s'] = max(row['max_s'], e['seconds'])
+        if 'alloc_bytes' in e:
+            row['alloc_bytes'] = row.get('alloc_bytes', 0) + e['alloc_bytes']
+            row['peak_bytes'] = max(row.get('peak_bytes', 0), e['peak_bytes'])
+        if 'max_rss_bytes' in e:
+            row['max_rss_bytes'] = max(row.get('max_rss_bytes', 0), e['max_rss_bytes'])
+    for row in rows.values():
+        row['mean_s'] = row['total_s'] / row['calls']
+    return sorted(rows.values(), key=lambda r: -r['total_s'])
+
+
+def save_trace(path):
+    """
+    Write the summary as CSV (path ending in .csv) or the events and summary as JSON.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    rows = summary()
+    if path.endswith('.csv'):
+        fields = ['name', 'config', 'calls', 'total_s', 'mean_s', 'max_s', 'alloc_bytes', 'peak_bytes',
+                  'max_rss_bytes']
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fields)
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        with open(path, 'w') as f:
+            json.dump({'events': events(), 'summary': rows}, f, indent=1)
+
+
+def save_chrome_trace(path):
+    """
+    Write the events in the Chrome trace event format (open in chrome://tracing or Perfetto),
+    one track per thread.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    pid = os.getpid()
+    tids = {}
+    trace = []
+    for e in events():
+        if e['thread'] not in tids:
+            tids[e['thread']] = len(tids)
+            trace.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tids[e['thread']],
+                          'args': {'name': e['thread']}})
+        args = {k: v for k, v in e.items() if k not in ('name', 'thread', 'start', 'seconds')}
+        trace.append({'name': e['name'], 'cat': e['config'] or 'stage', 'ph': 'X', 'pid': pid,
+                      'tid': tids[e['thread']], 'ts': 1e6 * e['start'], 'dur': 1e6 * e['seconds'], 'args': args})
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
+
+
+def format_summary(limit=25):
+    """
+    Table of the `limit` stages with the largest total time.
+    """
+    lines = [f"{'Stage':<44} {'Config':<28} {'Calls':>6} {'Total s':>9} {'Mean ms':>9} {'Peak MiB':>9}"]
+    for row in summary()[:limit]:
+        peak = f"{row['peak_bytes'] / 2 ** 20:>9.1f}" if 'peak_bytes' in row else f"{'-':>9}"
+        lines.append(f"{row['name'][:44]:<44} {row['config'][:28]:<28} {row['calls']:>6} {row['total_s']:>9.3f} "
+                     f"{1000 * row['mean_s']:>9.2f} {peak}")
+    return '\n'.join(lines)
@@ -0,0 +1,281 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+import profiling
+from compute_cache import array_fingerprint
+from profiling import profiled
+
+
+RENDER_BACKENDS = ('matplotlib', 'pil')
+
+# Per output directory, maps each figure file name to the fingerprint of its inputs
+RENDER_MANIFEST = '.render_manifest.json'
+
+# Breakpoints of matplotlib's 'hot' colormap (red, then green, then blue ramp up)
+HOT_BREAKS = (0.365079, 0.746032)
+
+# Spacing (pixels) around tiles and titles on the PIL canvas
+TILE_PAD = 6
+
+
+# A figure is a grid of cells, each cell one of the kinds below (or None for an empty slot).
+# The same description is drawn either with matplotlib (as the original subplot grids) or
+# composed directly into a NumPy canvas at native resolution and written with PIL.
+
+def gray_cell(image, title=None, fontsize=None, vmin=None, vmax=None):
+    """
+    Grayscale image, scaled to [vmin, vmax] (default: its own min and max).
+    """
+    return {'kind': 'gray', 'image': image, 'title': title, 'fontsize': fontsize, 'vmin': vmin, 'vmax': vmax}
+
+
+def mask_cell(mask, title=None, fontsize=None):
+    """
+    Binary mask, white where mask is 1.
+    """
+    return gray_cell(mask, title, fontsize, vmin=0, vmax=1)
+
+
+def heat_cell(derivative, title=None, fontsize=None):
+    """
+    Derivative magnitude with the 'hot' colormap.
+    """
+    return {'kind': 'heat', 'image': derivative, 'title': title, 'fontsize': fontsize}
+
+
+def overlay_cell(frame, mask, title=None, fontsize=None):
+    """
+    Frame with the mask pixels set to 255.
+    """
+    return {'kind': 'overlay', 'image': frame, 'mask': mask, 'title': title, 'fontsize': fontsize}
+
+
+def histogram_cell(values, threshold, label, title, xmax, ylabel=None):
+    """
+    Density histogram of values with a vertical threshold line. Always drawn with matplotlib.
+    """
+    return {'kind': 'hist', 'image': values, 'threshold': threshold, 'label': label,
+            'title': title, 'xmax': xmax, 'ylabel': ylabel}
+
+
+def make_figure(path, rows, figsize, hspace=0.05, wspace=0.05):
+    """
+    Figure saved to path. rows is a list of rows of cells; figsize, hspace and wspace
+    are only used by the matplotlib backend.
+    """
+    return {'path': path, 'rows': rows, 'figsize': figsize, 'hspace': hspace, 'wspace': wspace}
+
+
+def overlay_image(frame, mask):
+    """
+    Frame with the mask pixels set to 255, built in one pass (the frame is not modified).
+    """
+    return np.where(mask == 1, 255, frame)
+
+
+def figure_fingerprint(figure, backend):
+    """
+    Hash of everything a figure is drawn from: layout, titles and array contents.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr((backend, figure['figsize'], figure['hspace'], figure['wspace'])).encode())
+    for row in figure['rows']:
+        h.update(b'|')
+        for cell in row:
+            if cell is None:
+                h.update(b'-')
+                continue
+            for key in sorted(cell):
+                value = cell[key]
+                if isinstance(value, np.ndarray):
+                    value = array_fingerprint(value)
+                h.update(repr((key, value)).encode())
+    return h.hexdigest()
+
+
+def _to_uint8(image, vmin=None, vmax=None):
+    # Linear scaling to 0..255, like imshow's default normalization
+    image = np.asarray(image, dtype=np.float32)
+    lo = image.min() if vmin is None else vmin
+    hi = image.max() if vmax is None else vmax
+    if hi <= lo:
+        return np.zeros(image.shape, dtype=np.uint8)
+    scaled = (image - lo) * np.float32(255.0 / (hi - lo))
+    np.clip(scaled, 0, 255, out=scaled)
+    return (scaled + 0.5).astype(np.uint8)
+
+
+def hot_colormap(values):
+    """
+    Map values in [0, 1] to RGB uint8 with matplotlib's 'hot' colormap.
+    """
+    x = np.asarray(values, dtype=np.float32)
+    r1, r2 = HOT_BREAKS
+    rgb = np.empty(x.shape + (3,), dtype=np.uint8)
+    rgb[..., 0] = np.clip(x / r1 * 255, 0, 255)
+    rgb[..., 1] = np.clip((x - r1) / (r2 - r1) * 255, 0, 255)
+    rgb[..., 2] = np.clip((x - r2) / (1 - r2) * 255, 0, 255)
+    return rgb
+
+
+def _cell_pixels(cell):
+    # (H, W) uint8 for gray cells, (H, W, 3) uint8 for colored ones
+    kind = cell['kind']
+    if kind == 'gray':
+        return _to_uint8(cell['image'], cell['vmin'], cell['vmax'])
+    if kind == 'overlay':
+        return _to_uint8(overlay_image(cell['image'], cell['mask']))
+    if kind == 'heat':
+        magnitude = np.abs(cell['image'])
+        peak = magnitude.max()
+        return hot_colormap(magnitude / peak if peak > 0 else magnitude)
+    raise ValueError(f"Cell kind '{kind}' cannot be drawn with the PIL backend")
+
+
+@profiled()
+def _render_pil(figure):
+    font = ImageFont.load_default()
+    probe = ImageDraw.Draw(Image.new('L', (1, 1)))
+    line_h = probe.textbbox((0, 0), 'Ag', font=font)[3] + 2
+
+    rows = figure['rows']
+    tiles = [[_cell_pixels(cell) if cell is not None else None for cell in row] for row in rows]
+    shapes = [t.shape[:2] for row in tiles for t in row if t is not None]
+    tile_h = max(s[0] for s in shapes)
+    tile_w = max(s[1] for s in shapes)
+    n_cols = max(len(row) for row in rows)
+    title_h = [max([cell['title'].count('\n') + 1 for cell in row if cell is not None and cell['title']],
+                   default=0) * line_h for row in rows]
+
+    height = sum(title_h) + len(rows) * (tile_h + 2 * TILE_PAD) + TILE_PAD
+    width = n_cols * (tile_w + TILE_PAD) + TILE_PAD
+    canvas = np.full((height, width, 3), 255, dtype=np.uint8)
+    titles = []
+    y = TILE_PAD
+    for r, row in enumerate(rows):
+        y += TILE_PAD + title_h[r]
+        for c, (cell, tile) in enumerate(zip(row, tiles[r])):
+            if tile is None:
+                continue
+            x = TILE_PAD + c * (tile_w + TILE_PAD)
+            h, w = tile.shape[:2]
+            # Gray tiles broadcast over the three channels
+            canvas[y:y + h, x:x + w] = tile if tile.ndim == 3 else tile[..., None]
+            if cell['title']:
+                titles.append((x + tile_w // 2, y - title_h[r], cell['title']))
+        y += tile_h + TILE_PAD
+
+    image = Image.fromarray(canvas)
+    draw = ImageDraw.Draw(image)
+    for x, y, text in titles:
+        draw.multiline_text((x, y), text, fill=(0, 0, 0), font=font, anchor='ma', align='center')
+    image.save(figure['path'])
+
+
+def _draw_cell_matplotlib(ax, cell):
+    kind = cell['kind']
+    title_kwargs = {'fontsize': cell['fontsize']} if cell.get('fontsize') is not None else {}
+    if kind == 'hist':
+        ax.hist(cell['image'].ravel(), bins=100, color='steelblue', alpha=0.7, density=True)
+        ax.axvline(cell['threshold'], color='red', linewidth=2, label=cell['label'])
+        ax.set_title(cell['title'], fontsize=10)
+        ax.set_xlim(0, cell['xmax'])
+        ax.set_xlabel('|Pixel Derivative Value|', fontsize=9)
+        ax.legend(fontsize=8)
+        if cell['ylabel']:
+            ax.set_ylabel(cell['ylabel'], fontsize=10)
+        return
+    if kind == 'gray':
+        ax.imshow(cell['image'], cmap='gray', vmin=cell['vmin'], vmax=cell['vmax'])
+    elif kind == 'overlay':
+        ax.imshow(overlay_image(cell['image'], cell['mask']), cmap='gray')
+    elif kind == 'heat':
+        ax.imshow(np.abs(cell['image']), cmap='hot')
+    if cell['title']:
+        ax.set_title(cell['title'], **title_kwargs)
+    ax.axis('off')
+
+
+@profiled()
+def _render_matplotlib(figure):
+    import matplotlib.pyplot as plt
+
+    rows = figure['rows']
+    n_cols = max(len(row) for row in rows)
+    fig, axes = plt.subplots(len(rows), n_cols, figsize=figure['figsize'], squeeze=False)
+    plt.subplots_adjust(hspace=figure['hspace'], wspace=figure['wspace'])
+    for r, row in enumerate(rows):
+        for c in range(n_cols):
+            cell = row[c] if c < len(row) else None
+            if cell is None:
+                axes[r, c].axis('off')
+            else:
+                _draw_cell_matplotlib(axes[r, c], cell)
+    with profiling.stage('render.savefig'):
+        plt.savefig(figure['path'], dpi=150, bbox_inches='tight')
+    plt.close()
+
+
+def _needs_matplotlib(figure):
+    return any(cell is not None and cell['kind'] == 'hist' for row in figure['rows'] for cell in row)
+
+
+def _load_manifest(output_dir):
+    try:
+        with open(os.path.join(output_dir, RENDER_MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+@profiled()
+def save_figures(figures, backend='matplotlib', workers=None, skip_unchanged=False):
+    """
+    Draw and save a list of figures (see make_figure).
+    With backend='pil' the figures are composed as NumPy canvases and written with PIL on a
+    thread pool of `workers` threads (tile scaling and PNG compression release the GIL).
+    Figures with histogram cells, and all figures with backend='matplotlib', are drawn
+    serially with matplotlib, which is imported only then.
+    With skip_unchanged, a figure is not redrawn when its file exists and the fingerprint of
+    its inputs matches the one recorded in the directory's manifest.
+    Returns the number of figures drawn.
+    """
+    if backend not in RENDER_BACKENDS:
+        raise ValueError(f"Unknown render backend: {backend}")
+
+    manifests = {}
+    pending = []
+    for figure in figures:
+        output_dir, name = os.path.split(figure['path'])
+        fingerprint = None
+        if skip_unchanged:
+            if output_dir not in manifests:
+                manifests[output_dir] = _load_manifest(output_dir)
+            fingerprint = figure_fingerprint(figure, backend)
+            if manifests[output_dir].get(name) == fingerprint and os.path.exists(figure['path']):
+                continue
+        pending.append((figure, fingerprint))
+
+    with_pil = [f for f, _ in pending if backend == 'pil' and not _needs_matplotlib(f)]
+    with_matplotlib = [f for f, _ in pending if backend == 'matplotlib' or _needs_matplotlib(f)]
+    if workers == 1 or len(with_pil) < 2:
+        for figure in with_pil:
+            _render_pil(figure)
+    else:
+        with ThreadPoolExecutor(workers) as pool:
+            list(pool.map(_render_pil, with_pil))
+    for figure in with_matplotlib:
+        _render_matplotlib(figure)
+
+    if skip_unchanged:
+        for figure, fingerprint in pending:
+            output_dir, name = os.path.split(figure['path'])
+            manifests[output_dir][name] = fingerprint
+        for output_dir, manifest in manifests.items():
+            with open(os.path.join(output_dir, RENDER_MANIFEST), 'w') as f:
+                json.dump(manifest, f, indent=1, sort_keys=True)
+    return len(pending)
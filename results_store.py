@@ -0,0 +1,220 @@
+import json
+import os
+from collections.abc import Mapping
+import numpy as np
+
+
+class ResultRecord(Mapping):
+    """
+    Read-only view of one row of a ResultsStore. Scalars come from the columns, the mask
+    is unpacked on access and arrays such as the derivative are loaded only when read.
+    """
+
+    def __init__(self, store, row):
+        self._store = store
+        self._row = row
+
+    def __getitem__(self, name):
+        store = self._store
+        if name in store.columns:
+            return store.columns[name][self._row]
+        if name == 'mask' and store.has_mask(self._row):
+            return store.mask(self._row)
+        if name in store.arrays:
+            return store.array(name, self._row)
+        raise KeyError(name)
+
+    def _names(self):
+        names = list(self._store.columns)
+        if self._store.has_mask(self._row):
+            names.append('mask')
+        return names + [n for n in self._store.arrays if self._store.arrays[n][self._row] is not None]
+
+    def __iter__(self):
+        return iter(self._names())
+
+    def __len__(self):
+        return len(self._names())
+
+
+class ResultsStore(Mapping):
+    """
+    Columnar results table keyed like the results dicts in main.py.
+    Scalar metrics are stored one list per column, masks are bit-packed with np.packbits
+    and large arrays (derivatives, smoothed volumes) are kept as references or zero-arg
+    loaders that are only called on access. save() writes the table, the masks in
+    fixed-size chunks and optionally the arrays; load() maps them back lazily.
+    """
+
+    def __init__(self):
+        self.columns = {}
+        self.arrays = {}
+        self.mask_shape = None
+        self._keys = []
+        self._index = {}
+        self._masks = []
+        self._mask_chunks = None
+
+    def add(self, key, mask=None, arrays=None, **scalars):
+        """
+        Append a row. arrays maps names to arrays or to zero-arg callables returning them.
+        On a loaded store the saved packed masks are first read into memory.
+        """
+        if self._mask_chunks is not None:
+            self._materialize_masks()
+        row = len(self._keys)
+        self._keys.append(key)
+        self._index[key] = row
+        for name, value in scalars.items():
+            if name not in self.columns:
+                self.columns[name] = [None] * row
+        for name, column in self.columns.items():
+            column.append(scalars.get(name))
+        arrays = arrays or {}
+        for name in arrays:
+            if name not in self.arrays:
+                self.arrays[name] = [None] * row
+        for name, column in self.arrays.items():
+            column.append(arrays.get(name))
+        if mask is not None:
+            mask = np.asarray(mask)
+            if self.mask_shape is None:
+                self.mask_shape = mask.shape
+            elif mask.shape != self.mask_shape:
+                raise ValueError(f"Mask shape {mask.shape} does not match {self.mask_shape}")
+            self._masks.append(np.packbits(mask.astype(bool), axis=-1))
+        else:
+            self._masks.append(None)
+
+    def __getitem__(self, key):
+        return ResultRecord(self, self._index[key])
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def column(self, name):
+        """Return a scalar column as a numpy array."""
+        return np.array(self.columns[name])
+
+    def has_mask(self, row):
+        if self._mask_chunks is not None:
+            return self._mask_chunks['present'][row]
+        return self._masks[row] is not None
+
+    def mask(self, row):
+        """Unpack the uint8 mask of a row."""
+        return np.unpackbits(self._packed(row), axis=-1, count=self.mask_shape[-1])
+
+    def array(self, name, row):
+        """Return an array of a row, calling its loader if it was stored lazily."""
+        value = self.arrays[name][row]
+        return value() if callable(value) else value
+
+    def nbytes(self):
+        """Bytes held in memory by the packed masks."""
+        return sum(m.nbytes for m in self._masks if m is not None)
+
+    def save(self, path, arrays=('derivative',), chunk_rows=256):
+        """
+        Write the store to directory `path`: table.json with keys and scalar columns,
+        masks_XXXXX.npy chunks of chunk_rows packed masks and one .npy per distinct array
+        named in `arrays` (rows sharing an array reference share the file).
+        """
+        os.makedirs(path, exist_ok=True)
+        n_rows = len(self._keys)
+        present = [self.has_mask(row) for row in range(n_rows)]
+        n_chunks = 0
+        if self.mask_shape is not None:
+            empty = np.zeros(self.mask_shape[:-1] + ((self.mask_shape[-1] + 7) // 8,), dtype=np.uint8)
+            for start in range(0, n_rows, chunk_rows):
+                rows = range(start, min(start + chunk_rows, n_rows))
+                chunk = np.stack([self._packed(row) if present[row] else empty for row in rows])
+                np.save(os.path.join(path, f'masks_{n_chunks:05d}.npy'), chunk)
+                n_chunks += 1
+
+        array_files = {}
+        for name in arrays:
+            files = []
+            seen = {}
+            for row in range(n_rows):
+                value = self.arrays.get(name, [None] * n_rows)[row]
+                if value is None:
+                    files.append(None)
+                    continue
+                if id(value) not in seen:
+                    seen[id(value)] = f'{name}_{len(seen):05d}.npy'
+                    np.save(os.path.join(path, seen[id(value)]), self.array(name, row))
+                files.append(seen[id(value)])
+            array_files[name] = files
+
+        table = {
+            'keys': self._keys,
+            'columns': {name: [_to_json(v) for v in column] for name, column in self.columns.items()},
+            'mask_shape': list(self.mask_shape) if self.mask_shape is not None else None,
+            'mask_present': present,
+            'mask_chunk_rows': chunk_rows,
+            'mask_chunks': n_chunks,
+            'arrays': array_files,
+        }
+        with open(os.path.join(path, 'table.json'), 'w') as f:
+            json.dump(table, f)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Open a saved store. Masks and arrays are memory-mapped only when first read.
+        """
+        with open(os.path.join(path, 'table.json')) as f:
+            table = json.load(f)
+        store = cls()
+        store._keys = table['keys']
+        store._index = {key: row for row, key in enumerate(store._keys)}
+        store.columns = {name: [_from_json(v) for v in column] for name, column in table['columns'].items()}
+        store.mask_shape = tuple(table['mask_shape']) if table['mask_shape'] is not None else None
+        store._masks = []
+        store._mask_chunks = {'path': path, 'present': table['mask_present'],
+                              'chunk_rows': table['mask_chunk_rows'], 'loaded': {}}
+        for name, files in table['arrays'].items():
+            store.arrays[name] = [None if fname is None else _lazy_npy(os.path.join(path, fname))
+                                  for fname in files]
+        return store
+
+    def _materialize_masks(self):
+        # Copy the memory-mapped packed masks into the in-memory list used by add()
+        present = self._mask_chunks['present']
+        self._masks = [np.array(self._packed(row)) if present[row] else None for row in range(len(self._keys))]
+        self._mask_chunks = None
+
+    def _packed(self, row):
+        if self._mask_chunks is not None:
+            chunk_rows = self._mask_chunks['chunk_rows']
+            return self._load_mask_chunk(row // chunk_rows)[row % chunk_rows]
+        return self._masks[row]
+
+    def _load_mask_chunk(self, chunk):
+        loaded = self._mask_chunks['loaded']
+        if chunk not in loaded:
+            chunk_path = os.path.join(self._mask_chunks['path'], f'masks_{chunk:05d}.npy')
+            loaded[chunk] = np.load(chunk_path, mmap_mode='r')
+        return loaded[chunk]
+
+
+def _lazy_npy(path):
+    return lambda: np.load(path, mmap_mode='r')
+
+
+def _to_json(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, tuple):
+        return {'tuple': [_to_json(v) for v in value]}
+    return value
+
+
+def _from_json(value):
+    if isinstance(value, dict) and 'tuple' in value:
+        return tuple(value['tuple'])
+    return value
@@ -0,0 +1,165 @@
+import numpy as np
+from scipy.ndimage import maximum_filter
+
+from filters import BOX_SIZES, temporal_derivative_kernel, smooth_frame
+from tiled import region_derivative
+
+
+def downsample(frame, level):
+    """
+    Pyramid level `level` of a frame: means of 2**level x 2**level pixel blocks, built by
+    repeated 2x2 pooling (odd rows or columns are edge-padded at each step).
+    """
+    x = np.asarray(frame, dtype=np.float32)
+    for _ in range(level):
+        height, width = x.shape
+        if height % 2 or width % 2:
+            x = np.pad(x, ((0, height % 2), (0, width % 2)), mode='edge')
+        x = x[0::2] + x[1::2]
+        x = x[:, 0::2] + x[:, 1::2]
+    return x * np.float32(1.0 / 4 ** level) if level else x
+
+
+def _coarse_smoothing(method, param, scale):
+    # The spatial filter in pixels of a pyramid level downsampled by `scale`
+    if method is None or scale == 1:
+        return method, param
+    if method == 'gaussian':
+        return method, param / scale
+    return 'box', max(1, round((BOX_SIZES.get(method) or int(param)) / scale))
+
+
+def coarse_derivative(frames_array, index, spatial_method, spatial_param, temporal_method, temporal_sigma=None,
+                      level=2, pyramid=None):
+    """
+    The fused spatio-temporal derivative at frame[index] computed on the downsampled pyramid
+    level: sum_j w_j * coarse frame_j, smoothed by the spatial filter scaled to that level.
+    pyramid is an optional dict of already downsampled frames {frame index: coarse frame},
+    kept by the caller across consecutive frames so each frame is downsampled only once;
+    entries older than the window are dropped.
+    """
+    weights = temporal_derivative_kernel(temporal_method, temporal_sigma)
+    margin = len(weights) // 2
+    if pyramid is None:
+        pyramid = {}
+    for j in [j for j in pyramid if j < index - margin]:
+        del pyramid[j]
+    for j in range(index - margin, index + margin + 1):
+        if j not in pyramid:
+            pyramid[j] = downsample(frames_array[j], level)
+    combined = np.zeros_like(pyramid[index])
+    for j, w in enumerate(weights):
+        if w != 0:
+            combined += np.float32(w) * pyramid[index - margin + j]
+    method, param = _coarse_smoothing(spatial_method, spatial_param, 2 ** level)
+    return smooth_frame(combined, method, param, np.float32)
+
+
+def active_blocks(frames_array, index, threshold, spatial_method, spatial_param, temporal_method,
+                  temporal_sigma=None, block_size=32, level=2, coarse_factor=0.75, pyramid=None):
+    """
+    Boolean grid of the block_size x block_size blocks of frame[index] that may contain
+    |derivative| > threshold.
+    The derivative is linear in the frames, so on the coarse level it is approximately the
+    block mean of the full-resolution derivative (coarse_derivative). A block is active when
+    the largest coarse |derivative| in it or in the coarse cells bordering it exceeds
+    coarse_factor * threshold; the factor absorbs the peaks that averaging flattens. This is
+    a heuristic, not a bound: sparse_motion_mask checks what it misses.
+    Savings need a threshold well above the noise of the derivative: moving edges then stand
+    far above it and the noise at the coarse level stays below it, so only the blocks around
+    moving objects are active, and the fewer the larger k is in k * sigma_noise. Spatial
+    smoothing already averages the noise about as much as the pyramid does, so a threshold
+    within a few noise sigmas (e.g. a high percentile of a mostly static frame, where the
+    dense mask is largely isolated noise pixels) activates every block and saves nothing.
+    """
+    scale = 2 ** level
+    if block_size % scale:
+        raise ValueError(f"block_size must be a multiple of 2**level ({scale})")
+    peak = maximum_filter(np.abs(coarse_derivative(frames_array, index, spatial_method, spatial_param,
+                                                   temporal_method, temporal_sigma, level, pyramid)), size=3)
+    cells = block_size // scale
+    pad_h, pad_w = -peak.shape[0] % cells, -peak.shape[1] % cells
+    peak = np.pad(peak, ((0, pad_h), (0, pad_w)))
+    block_peak = peak.reshape(peak.shape[0] // cells, cells, peak.shape[1] // cells, cells).max(axis=(1, 3))
+    return block_peak > coarse_factor * threshold
+
+
+def _filter_blocks(deriv, blocks, block_size, frames_array, index, spatial_method, spatial_param, temporal_method,
+                   temporal_sigma, dtype):
+    # Fill deriv inside the flagged blocks; horizontal runs of blocks are filtered as one
+    # region (with the spatial halo)
+    height, width = deriv.shape
+    for block_row, row in enumerate(blocks):
+        cols = np.flatnonzero(row)
+        if cols.size == 0:
+            continue
+        rows = slice(block_row * block_size, min((block_row + 1) * block_size, height))
+        for run in np.split(cols, np.flatnonzero(np.diff(cols) > 1) + 1):
+            run_cols = slice(run[0] * block_size, min((run[-1] + 1) * block_size, width))
+            deriv[rows, run_cols] = region_derivative(frames_array, index, rows, run_cols, spatial_method,
+                                                      spatial_param, temporal_method, temporal_sigma, dtype)
+
+
+def _block_counts(mask, block_size):
+    # Number of mask pixels in each block
+    pad_h, pad_w = -mask.shape[0] % block_size, -mask.shape[1] % block_size
+    padded = np.pad(mask, ((0, pad_h), (0, pad_w)))
+    return padded.reshape(padded.shape[0] // block_size, block_size,
+                          padded.shape[1] // block_size, block_size).sum(axis=(1, 3), dtype=np.int64)
+
+
+def sparse_motion_mask(frames_array, index, threshold, spatial_method, spatial_param, temporal_method,
+                       temporal_sigma=None, block_size=32, level=2, tolerance=0.01, check_every=16,
+                       coarse_factor=0.75, max_active=0.5, dtype=float, pyramid=None):
+    """
+    Motion mask |derivative| > threshold at frame[index], computing the fused spatio-temporal
+    derivative only inside the blocks flagged by active_blocks, where it is the dense
+    derivative. Inside the skipped blocks the mask is empty, which misses whatever the
+    coarse heuristic did not flag. To keep that in check, every check_every-th skipped block
+    is filtered as well, and the mask pixels found there estimate the share of the dense mask
+    lying in the unchecked blocks. When that estimate exceeds `tolerance` (a fraction of the
+    mask's pixels) the remaining blocks are filtered too, so the result is the dense mask.
+    The estimate is a sample: the misses stay within the tolerance up to its sampling error.
+    When more than max_active of the blocks are active the whole frame is filtered at once.
+    The threshold must be known beforehand (fixed, or k * sigma_noise from e.g. a
+    thresholds.RunningNoiseEstimator).
+    Returns (mask, derivative, filtered, missed): the derivative is zero in the blocks not
+    filtered, `filtered` is the block grid that was filtered and `missed` the estimated
+    fraction of the dense mask's pixels absent from this one (0.0 when every block was
+    filtered). Returns None without full temporal support. Pass the same `pyramid` dict for
+    consecutive frames of a sequence to reuse the downsampled frames (see coarse_derivative).
+    """
+    margin = len(temporal_derivative_kernel(temporal_method, temporal_sigma)) // 2
+    if index < margin or index >= len(frames_array) - margin:
+        return None
+    height, width = np.shape(frames_array[index])
+    active = active_blocks(frames_array, index, threshold, spatial_method, spatial_param, temporal_method,
+                           temporal_sigma, block_size, level, coarse_factor, pyramid)
+    filters_args = (frames_array, index, spatial_method, spatial_param, temporal_method, temporal_sigma, dtype)
+    if active.mean() > max_active:
+        deriv = region_derivative(frames_array, index, slice(0, height), slice(0, width), spatial_method,
+                                  spatial_param, temporal_method, temporal_sigma, dtype)
+        mask = (np.abs(deriv) > threshold).astype(np.uint8)
+        return mask, deriv, np.ones_like(active), 0.0
+
+    skipped = np.flatnonzero(~active)
+    checked = skipped[::check_every]
+    filtered = active.copy()
+    filtered.flat[checked] = True
+    deriv = np.zeros((height, width), dtype=dtype)
+    _filter_blocks(deriv, filtered, block_size, *filters_args)
+    mask = (np.abs(deriv) > threshold).astype(np.uint8)
+
+    missed = 0.0
+    unchecked = skipped.size - checked.size
+    if unchecked:
+        counts = _block_counts(mask, block_size)
+        expected = counts.flat[checked].sum() * unchecked / checked.size
+        missed = expected / (counts.sum() + expected) if expected else 0.0
+        if missed > tolerance:
+            rest = ~filtered
+            _filter_blocks(deriv, rest, block_size, *filters_args)
+            filtered[:] = True
+            mask = (np.abs(deriv) > threshold).astype(np.uint8)
+            missed = 0.0
+    return mask, deriv, filtered, missed
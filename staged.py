@@ -0,0 +1,141 @@
+import queue
+import threading
+import time
+
+
+# Marks the end of a stage's output in its queue
+_END = object()
+
+# Seconds between checks of the stop flag while blocked on a queue
+_POLL = 0.1
+
+
+class Stage:
+    """
+    One step of a pipeline. fn maps the iterator of the stage inputs to an iterable of
+    outputs (usually a generator, so a stage can keep state across items); the first stage
+    of a pipeline is called without arguments and produces the source items.
+    After run_pipeline, items is the number of items received (produced for the first stage),
+    wait_in / wait_out the seconds spent blocked on the input / output queue, and busy the
+    rest of the stage's wall time.
+    """
+
+    def __init__(self, name, fn):
+        self.name = name
+        self.fn = fn
+        self.items = 0
+        self.wall = 0.0
+        self.wait_in = 0.0
+        self.wait_out = 0.0
+
+    @property
+    def busy(self):
+        return max(0.0, self.wall - self.wait_in - self.wait_out)
+
+    @property
+    def utilization(self):
+        """Fraction of the stage's wall time spent working."""
+        return self.busy / self.wall if self.wall else 0.0
+
+
+class _Stopped(Exception):
+    pass
+
+
+def _inputs(stage, inbox, stop):
+    # Iterator over the upstream queue, timing the waits
+    while True:
+        t0 = time.perf_counter()
+        while True:
+            try:
+                item = inbox.get(timeout=_POLL)
+                break
+            except queue.Empty:
+                if stop.is_set():
+                    raise _Stopped()
+        stage.wait_in += time.perf_counter() - t0
+        if item is _END:
+            return
+        stage.items += 1
+        yield item
+
+
+def _put(stage, outbox, item, stop):
+    t0 = time.perf_counter()
+    while True:
+        try:
+            outbox.put(item, timeout=_POLL)
+            break
+        except queue.Full:
+            if stop.is_set():
+                raise _Stopped()
+    stage.wait_out += time.perf_counter() - t0
+
+
+def _run_stage(stage, inbox, outbox, stop, errors):
+    t_start = time.perf_counter()
+    try:
+        outputs = stage.fn() if inbox is None else stage.fn(_inputs(stage, inbox, stop))
+        for item in outputs:
+            if inbox is None:
+                stage.items += 1
+            if outbox is not None:
+                _put(stage, outbox, item, stop)
+        if outbox is not None:
+            _put(stage, outbox, _END, stop)
+    except _Stopped:
+        pass
+    except BaseException as e:
+        errors.append(e)
+        stop.set()
+    finally:
+        stage.wall = time.perf_counter() - t_start
+
+
+def run_pipeline(stages, queue_size=4, threaded=True):
+    """
+    Run stages connected by bounded queues, each on its own thread. A full queue blocks
+    its producer (backpressure), so at most queue_size items wait between two stages and
+    the end-to-end time approaches that of the slowest stage rather than the sum.
+    Decoding, numpy/scipy filtering and file writes release the GIL for most of their work.
+    The outputs of the last stage are discarded. An exception in any stage stops the
+    others and is re-raised here. threaded=False chains the stages in the calling thread.
+    Returns the wall time in seconds; the per-stage statistics are left on the stages.
+    """
+    t_start = time.perf_counter()
+    if not threaded:
+        outputs = stages[0].fn()
+        for stage in stages[1:]:
+            outputs = stage.fn(outputs)
+        for _ in outputs:
+            pass
+        return time.perf_counter() - t_start
+
+    stop = threading.Event()
+    errors = []
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages[1:]]
+    threads = []
+    for i, stage in enumerate(stages):
+        inbox = queues[i - 1] if i > 0 else None
+        outbox = queues[i] if i < len(queues) else None
+        threads.append(threading.Thread(target=_run_stage, args=(stage, inbox, outbox, stop, errors),
+                                        name=f'stage-{stage.name}', daemon=True))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return time.perf_counter() - t_start
+
+
+def format_stage_stats(stages, wall):
+    """
+    Table of the per-stage item counts, busy time and utilization after run_pipeline.
+    """
+    lines = [f"{'Stage':<12} {'Items':>7} {'Busy s':>8} {'Util%':>7} {'Wait in':>8} {'Wait out':>9}"]
+    for stage in stages:
+        lines.append(f"{stage.name:<12} {stage.items:>7} {stage.busy:>8.2f} {100 * stage.utilization:>6.1f}% "
+                     f"{stage.wait_in:>8.2f} {stage.wait_out:>9.2f}")
+    lines.append(f"{'total wall':<12} {'':>7} {wall:>8.2f}")
+    return '\n'.join(lines)
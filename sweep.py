@@ -0,0 +1,107 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+
+import profiling
+from compute_cache import cached_spatial_smoothing, cached_temporal_derivative
+from filters import apply_spatial_smoothing, temporal_margin
+from metrics import analyze_derivative
+
+
+_worker_state = {}
+
+
+def sweep_tasks(spatial_configs, temporal_configs):
+    """
+    The spatial x temporal grid in the fixed order used by the serial loop in main.py.
+    """
+    return [(s_cfg, t_cfg) for s_cfg in spatial_configs for t_cfg in temporal_configs]
+
+
+def evaluate_config(frames_array, test_frame_idx, s_cfg, t_cfg, percentile_values, dtype=float,
+                    backend='exact', percentile_method='exact', return_arrays=False, cache=None):
+    """
+    Rows (one per percentile) for one spatial + temporal configuration at test_frame_idx.
+    Without a cache only the frames inside the temporal support are smoothed; spatial
+    smoothing is per frame, so the result is identical to smoothing the whole volume.
+    """
+    s_name, s_method, s_param = s_cfg
+    t_name, t_method, t_param = t_cfg
+    margin = temporal_margin(t_method, t_param)
+    if cache is None:
+        start = max(0, test_frame_idx - margin)
+        stop = min(len(frames_array), test_frame_idx + margin + 1)
+        smoothed = apply_spatial_smoothing(frames_array[start:stop], s_method, s_param, dtype=dtype,
+                                           backend=backend)
+        local_idx = test_frame_idx - start
+    else:
+        smoothed = cached_spatial_smoothing(cache, frames_array, s_method, s_param, dtype=dtype,
+                                            backend=backend)
+        local_idx = test_frame_idx
+    deriv = cached_temporal_derivative(cache, smoothed, local_idx, t_method, t_param, dtype=dtype)
+    if deriv is None:
+        return []
+
+    snr, analysis = analyze_derivative(deriv, [('percentile', pct) for pct in percentile_values],
+                                       percentile_method=percentile_method)
+    rows = []
+    for pct, res in zip(percentile_values, analysis):
+        row = {
+            'spatial': s_name, 'temporal': t_name, 'percentile': pct,
+            'threshold': res['threshold'], 'motion_pct': res['motion_pct'],
+            'snr': snr, 'lcc': res['lcc'],
+            'frame_range': (test_frame_idx - margin, test_frame_idx + margin),
+        }
+        if return_arrays:
+            row['derivative'] = deriv
+            row['mask'] = res['mask']
+        rows.append(row)
+    return rows
+
+
+def _init_worker(shm_name, shape, dtype):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _worker_state['shm'] = shm
+    _worker_state['frames'] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _run_task(args):
+    return evaluate_config(_worker_state['frames'], *args)
+
+
+def run_sweep(frames_array, test_frame_idx, spatial_configs, temporal_configs, percentile_values,
+              workers=1, dtype=float, backend='exact', percentile_method='exact',
+              return_arrays=False, cache=None):
+    """
+    Evaluate the spatial x temporal x percentile grid and return one row per cell, in
+    grid order. With workers > 1 the configurations run on a process pool whose
+    workers read the frames from shared memory instead of receiving a pickled copy;
+    results are gathered in submission order, so the table matches the serial run.
+    The cache is only used by the serial path.
+    """
+    tasks = sweep_tasks(spatial_configs, temporal_configs)
+    if workers <= 1:
+        rows = []
+        for s_cfg, t_cfg in tasks:
+            with profiling.configuration(f'{s_cfg[0]} + {t_cfg[0]}'), profiling.stage('sweep.evaluate_config'):
+                rows.extend(evaluate_config(frames_array, test_frame_idx, s_cfg, t_cfg, percentile_values,
+                                            dtype, backend, percentile_method, return_arrays, cache))
+        return rows
+
+    frames_array = np.ascontiguousarray(frames_array)
+    shm = shared_memory.SharedMemory(create=True, size=max(frames_array.nbytes, 1))
+    try:
+        shared = np.ndarray(frames_array.shape, dtype=frames_array.dtype, buffer=shm.buf)
+        shared[...] = frames_array
+        args = [(test_frame_idx, s_cfg, t_cfg, percentile_values, dtype, backend,
+                 percentile_method, return_arrays) for s_cfg, t_cfg in tasks]
+        # The workers are separate processes, so profiling only times the pool as a whole
+        with profiling.stage('sweep.process_pool'), \
+                ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                    initargs=(shm.name, frames_array.shape, frames_array.dtype)) as pool:
+            rows = [row for task_rows in pool.map(_run_task, args) for row in task_rows]
+        del shared
+    finally:
+        shm.close()
+        shm.unlink()
+    return rows
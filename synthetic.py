@@ -0,0 +1,104 @@
+import os
+import numpy as np
+from PIL import Image
+from scipy.ndimage import gaussian_filter
+
+
+# (height, width) of the named resolutions
+RESOLUTIONS = {
+    'vga': (480, 640),
+    '720p': (720, 1280),
+    '1080p': (1080, 1920),
+    '4k': (2160, 3840),
+    '8k': (4320, 7680),
+}
+
+
+def synthetic_background(height, width, seed=0, contrast=60.0):
+    """
+    Static textured background: low-frequency noise around mid-gray, built at 1/8 resolution
+    and upsampled so it stays cheap at 8K.
+    """
+    rng = np.random.default_rng(seed)
+    small = gaussian_filter(rng.standard_normal((height // 8 + 2, width // 8 + 2)), 2.0)
+    small *= contrast / (small.std() + 1e-12)
+    big = np.repeat(np.repeat(small, 8, axis=0), 8, axis=1)[:height, :width]
+    return np.clip(128 + big, 0, 255).astype(np.float32)
+
+
+def iter_synthetic_frames(n_frames=60, height=480, width=640, n_objects=3, size=40, speed=4.0,
+                          noise_sigma=2.0, intensity=230.0, seed=0):
+    """
+    Lazily yield (frame, mask) for a sequence of rectangles moving over a static textured
+    background with Gaussian sensor noise. Frames are uint8 (H, W); mask is the uint8
+    ground-truth footprint of the objects in that frame.
+    Each object has a random start, a random direction at `speed` pixels per frame and
+    bounces off the borders; its side lengths vary around `size`.
+    """
+    rng = np.random.default_rng(seed)
+    background = synthetic_background(height, width, seed)
+    sizes = np.maximum(2, (size * rng.uniform(0.6, 1.4, (n_objects, 2)))).astype(int)
+    sizes = np.minimum(sizes, [height - 1, width - 1])
+    position = rng.uniform(0, 1, (n_objects, 2)) * ([height, width] - sizes)
+    angle = rng.uniform(0, 2 * np.pi, n_objects)
+    velocity = speed * np.stack([np.sin(angle), np.cos(angle)], axis=1)
+    for _ in range(n_frames):
+        frame = background.copy()
+        mask = np.zeros((height, width), dtype=np.uint8)
+        for (r, c), (h, w) in zip(position.astype(int), sizes):
+            frame[r:r + h, c:c + w] = intensity
+            mask[r:r + h, c:c + w] = 1
+        if noise_sigma:
+            frame += rng.normal(0, noise_sigma, frame.shape).astype(np.float32)
+        yield np.clip(frame + 0.5, 0, 255).astype(np.uint8), mask
+        position += velocity
+        # Bounce off the borders
+        limit = np.array([height, width]) - sizes
+        hit = (position < 0) | (position > limit)
+        velocity[hit] *= -1
+        position = np.clip(position, 0, limit)
+
+
+def synthetic_sequence(n_frames=60, height=480, width=640, **kwargs):
+    """
+    The whole sequence of iter_synthetic_frames as (frames, masks) arrays of shape (T, H, W).
+    """
+    frames = np.empty((n_frames, height, width), dtype=np.uint8)
+    masks = np.empty((n_frames, height, width), dtype=np.uint8)
+    for t, (frame, mask) in enumerate(iter_synthetic_frames(n_frames, height, width, **kwargs)):
+        frames[t] = frame
+        masks[t] = mask
+    return frames, masks
+
+
+def write_synthetic_sequence(output_dir, n_frames=60, height=480, width=640, **kwargs):
+    """
+    Write the frames of iter_synthetic_frames as frame_XXXXXX.png in output_dir (usable as
+    config.IMAGE_DIR) and the ground-truth masks, bit-packed, to output_dir/ground_truth.npy.
+    Frames are written one at a time, so long 8K sequences do not need to fit in memory.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    packed = np.empty((n_frames, height, (width + 7) // 8), dtype=np.uint8)
+    for t, (frame, mask) in enumerate(iter_synthetic_frames(n_frames, height, width, **kwargs)):
+        Image.fromarray(frame).save(os.path.join(output_dir, f'frame_{t:06d}.png'))
+        packed[t] = np.packbits(mask, axis=-1)
+    # Stored outside the frame list (list_frame_files only picks up images)
+    np.save(os.path.join(output_dir, 'ground_truth.npy'), packed)
+
+
+def motion_ground_truth(masks, index, margin=1):
+    """
+    Pixels whose object occupancy changes within frames index-margin .. index+margin, i.e.
+    what a temporal derivative with that support is expected to detect.
+    """
+    window = np.asarray(masks[index - margin:index + margin + 1], dtype=bool)
+    return (window.any(axis=0) & ~window.all(axis=0)).astype(np.uint8)
+
+
+def mask_iou(mask, truth):
+    """
+    Intersection over union of two binary masks (1.0 when both are empty).
+    """
+    mask, truth = np.asarray(mask, dtype=bool), np.asarray(truth, dtype=bool)
+    union = np.count_nonzero(mask | truth)
+    return np.count_nonzero(mask & truth) / union if union else 1.0
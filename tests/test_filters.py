@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+from scipy.ndimage import gaussian_filter, uniform_filter
+
+from filters import (apply_spatial_smoothing, gaussian_derivative_filter, simple_derivative_filter,
+                     temporal_derivative_kernel, temporal_derivative_volume)
+from synthetic import synthetic_sequence
+
+
+def _test_frames():
+    # Noise-like texture plus a small bright blob and a step edge, in 8-bit range
+    rng = np.random.default_rng(0)
+    frames = rng.uniform(0, 255, (2, 97, 131))
+    yy, xx = np.mgrid[:97, :131]
+    frames[0] = 255.0 * ((yy - 48) ** 2 + (xx - 40) ** 2 < 15 ** 2)
+    frames[1, :, 90:] = 255.0
+    return frames
+
+
+@pytest.mark.parametrize('size', [3, 5, 9, 15])
+def test_fast_box_matches_uniform_filter(size):
+    frames = _test_frames()
+    fast = apply_spatial_smoothing(frames, 'box', size, backend='fast')
+    np.testing.assert_allclose(fast, uniform_filter(frames, size=(1, size, size)), atol=1e-8)
+
+
+@pytest.mark.parametrize('dtype', [np.float64, np.float32])
+@pytest.mark.parametrize('sigma', [10, 12, 16, 24])
+def test_fast_gaussian_within_stated_error(sigma, dtype):
+    frames = _test_frames()
+    fast = apply_spatial_smoothing(frames, 'gaussian', sigma, dtype=dtype, backend='fast')
+    assert fast.dtype == dtype
+    error = np.abs(fast - gaussian_filter(frames, sigma=(0, sigma, sigma)))
+    # The bound documented for the recursive Gaussian: ~3% of the value range
+    assert error.max() <= 0.03 * 255
+
+
+def _per_frame(frames, index, method, sigma, dtype):
+    if method == 'simple':
+        return simple_derivative_filter(frames, index, dtype)
+    return gaussian_derivative_filter(frames, index, sigma, dtype)
+
+
+TEMPORAL = [('simple', None), ('gaussian', 0.8), ('gaussian', 1.5), ('gaussian', 2.0)]
+
+
+@pytest.mark.parametrize('dtype', [np.float64, np.float32])
+@pytest.mark.parametrize('method, sigma', TEMPORAL)
+def test_valid_volume_matches_per_frame_filters(method, sigma, dtype):
+    frames, _ = synthetic_sequence(17, 40, 56, seed=1)
+    volume = temporal_derivative_volume(frames, method, sigma, 'valid', dtype)
+    margin = len(temporal_derivative_kernel(method, sigma)) // 2
+    assert volume.shape == (len(frames) - 2 * margin,) + frames.shape[1:]
+    assert volume.dtype == dtype
+    rtol = 1e-5 if dtype == np.float32 else 1e-10
+    for index in range(margin, len(frames) - margin):
+        expected = _per_frame(frames, index, method, sigma, dtype)
+        np.testing.assert_allclose(volume[index - margin], expected, rtol=rtol, atol=rtol * 255)
+
+
+@pytest.mark.parametrize('mode, pad_mode', [('reflect', 'symmetric'), ('nearest', 'edge')])
+@pytest.mark.parametrize('method, sigma', TEMPORAL)
+def test_extended_volume_matches_per_frame_filters_on_padded_frames(method, sigma, mode, pad_mode):
+    frames, _ = synthetic_sequence(9, 40, 56, seed=2)
+    volume = temporal_derivative_volume(frames, method, sigma, mode)
+    assert volume.shape == frames.shape
+    # The boundary frames see the sequence extended the same way at both ends
+    margin = len(temporal_derivative_kernel(method, sigma)) // 2
+    padded = np.pad(frames, [(margin, margin), (0, 0), (0, 0)], mode=pad_mode)
+    for index in range(len(frames)):
+        expected = _per_frame(padded, index + margin, method, sigma, float)
+        np.testing.assert_allclose(volume[index], expected, rtol=1e-10, atol=1e-8)
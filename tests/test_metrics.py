@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+from scipy.ndimage import gaussian_filter, label
+
+from metrics import analyze_derivative, compute_largest_component_ratio, largest_component_sweep
+from thresholds import noise_sigma_from_abs
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_largest_component_sweep_matches_labeling(seed):
+    rng = np.random.default_rng(seed)
+    derivative = np.round(4 * gaussian_filter(rng.standard_normal((60, 80)), 1.0 + seed / 2), 1)
+    abs_d = np.abs(derivative)
+    # Unsorted, with a repeated threshold, one equal to pixel values and one above every pixel
+    thresholds = np.concatenate([rng.choice(abs_d.ravel(), 8), [0.3, 0.3, abs_d.max() + 1]])
+    result = largest_component_sweep(derivative, thresholds)
+    for i, t in enumerate(thresholds):
+        mask = (abs_d > t).astype(np.uint8)
+        assert result['num_components'][i] == label(mask)[1]
+        assert result['lcc'][i] == pytest.approx(compute_largest_component_ratio(mask))
+        assert result['motion_pct'][i] == pytest.approx(100 * mask.mean())
+
+
+@pytest.mark.parametrize('noise_method', ['exact', 'histogram'])
+def test_analyze_derivative_histogram_matches_exact(noise_method):
+    rng = np.random.default_rng(0)
+    derivative = np.round(rng.normal(0, 3, (120, 160)))
+    derivative[40:60, 50:90] += 40
+    strategies = [('percentile', 90), ('noise', 4), ('fixed', 10)]
+    snr, exact = analyze_derivative(derivative, strategies, 'exact', noise_method)
+    snr_h, hist = analyze_derivative(derivative, strategies, 'histogram', noise_method)
+    width = np.abs(derivative).max() / 4096
+    assert snr_h == pytest.approx(snr, rel=0.01)
+    for e, h in zip(exact, hist):
+        assert abs(h['threshold'] - e['threshold']) <= 4 * width
+    assert hist[1]['sigma_noise'] == pytest.approx(noise_sigma_from_abs(np.abs(derivative), noise_method))
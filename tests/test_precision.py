@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+import config
+from filters import PRECISION_DTYPES, spatio_temporal_derivative
+from metrics import analyze_derivative
+from sweep import run_sweep
+from synthetic import synthetic_sequence
+
+
+# Largest deviations of PRECISION='float32' from the float64 reference that are accepted.
+# Thresholds agree to float32 rounding everywhere. With Gaussian smoothing the masks are
+# practically identical. Box filters of quantized uint8 frames give many derivative values
+# that tie exactly with a percentile threshold, and float32 rounding decides those ties
+# differently, so motion %, LCC and SNR get a looser bound there.
+THRESHOLD_RTOL = 1e-4
+GAUSS_TOLERANCES = {'motion_pct': 0.01, 'lcc': 1e-3, 'snr_rtol': 1e-3}
+BOX_TOLERANCES = {'motion_pct': 2.0, 'lcc': 0.02, 'snr_rtol': 0.1}
+
+
+def _sweep(frames, index, precision):
+    frame_dtype, work_dtype = PRECISION_DTYPES[precision]
+    return run_sweep(frames.astype(frame_dtype), index, config.SPATIAL_CONFIGS, config.TEMPORAL_CONFIGS,
+                     config.PERCENTILE_VALUES, dtype=work_dtype)
+
+
+@pytest.mark.parametrize('seed', [0, 3, 7])
+def test_float32_sweep_matches_float64(seed):
+    frames, _ = synthetic_sequence(41, 240, 320, seed=seed)
+    rows64 = _sweep(frames, 20, 'float64')
+    rows32 = _sweep(frames, 20, 'float32')
+    assert len(rows64) == len(rows32) > 0
+    for ref, low in zip(rows64, rows32):
+        assert (ref['spatial'], ref['temporal'], ref['percentile']) == (low['spatial'], low['temporal'],
+                                                                       low['percentile'])
+        tol = BOX_TOLERANCES if ref['spatial'].startswith('Box') else GAUSS_TOLERANCES
+        assert low['threshold'] == pytest.approx(ref['threshold'], rel=THRESHOLD_RTOL)
+        assert abs(low['motion_pct'] - ref['motion_pct']) <= tol['motion_pct']
+        assert abs(low['lcc'] - ref['lcc']) <= tol['lcc']
+        assert low['snr'] == pytest.approx(ref['snr'], rel=tol['snr_rtol'])
+
+
+def test_float32_noise_model_matches_float64():
+    frames, _ = synthetic_sequence(41, 240, 320, seed=1)
+    strategies = [('fixed', 2)] + [('noise', k) for k in config.K_VALUES]
+    derivs = {}
+    for precision in ('float64', 'float32'):
+        frame_dtype, work_dtype = PRECISION_DTYPES[precision]
+        derivs[precision] = spatio_temporal_derivative(frames.astype(frame_dtype), 20, 'gaussian', 1.5,
+                                                       'gaussian', 1.5, work_dtype)
+    assert derivs['float32'].dtype == np.float32
+    _, ref = analyze_derivative(derivs['float64'], strategies)
+    _, low = analyze_derivative(derivs['float32'], strategies)
+    for r, l in zip(ref, low):
+        assert l['threshold'] == pytest.approx(r['threshold'], rel=THRESHOLD_RTOL)
+        assert abs(l['motion_pct'] - r['motion_pct']) <= GAUSS_TOLERANCES['motion_pct']
+        assert abs(l['lcc'] - r['lcc']) <= GAUSS_TOLERANCES['lcc']
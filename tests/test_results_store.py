@@ -0,0 +1,28 @@
+import numpy as np
+
+from results_store import ResultsStore
+
+
+def test_save_load_add_round_trip(tmp_path):
+    rng = np.random.default_rng(0)
+    masks = [rng.random((5, 11)) > 0.5 for _ in range(3)]
+    store = ResultsStore()
+    store.add('a', mask=masks[0], threshold=1.5, lcc=0.25, arrays={'derivative': rng.random((5, 11))})
+    store.add('no mask', threshold=2.0)
+    store.save(str(tmp_path / 'first'), chunk_rows=1)
+
+    loaded = ResultsStore.load(str(tmp_path / 'first'))
+    loaded.add('b', mask=masks[1], threshold=3.0, config=('gaussian', 1.5))
+    loaded.add('c', mask=masks[2])
+    assert list(loaded) == ['a', 'no mask', 'b', 'c']
+    assert [loaded.has_mask(row) for row in range(4)] == [True, False, True, True]
+    np.testing.assert_array_equal(loaded.mask(2), masks[1])
+    loaded.save(str(tmp_path / 'second'))
+
+    again = ResultsStore.load(str(tmp_path / 'second'))
+    for key, mask in zip(['a', 'b', 'c'], masks):
+        np.testing.assert_array_equal(again[key]['mask'], mask)
+    assert 'mask' not in again['no mask']
+    assert list(again.column('threshold')) == [1.5, 2.0, 3.0, None]
+    assert again['b']['config'] == ('gaussian', 1.5)
+    np.testing.assert_array_equal(again['a']['derivative'], store['a']['derivative'])
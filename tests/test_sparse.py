@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+import filters
+from sparse import sparse_motion_mask
+from synthetic import synthetic_sequence
+from thresholds import estimate_noise_sigma
+
+
+CONFIGS = [(None, None, 'simple', None), ('gaussian', 1.5, 'gaussian', 1.5), ('box_5x5', None, 'simple', None)]
+
+
+@pytest.mark.parametrize('config', CONFIGS)
+@pytest.mark.parametrize('seed', [0, 1])
+def test_sparse_mask_misses_within_tolerance(config, seed):
+    frames, _ = synthetic_sequence(17, 240, 320, seed=seed)
+    deriv = filters.spatio_temporal_derivative(frames, 8, *config)
+    sigma = estimate_noise_sigma(deriv)
+    for k in (3, 5, 8, 16):
+        threshold = k * sigma
+        dense = np.abs(deriv) > threshold
+        mask, sparse_deriv, filtered, missed = sparse_motion_mask(frames, 8, threshold, *config, tolerance=0.01)
+        mask = mask.astype(bool)
+        # Never a pixel the dense path does not have, and at most 1% of its pixels missed
+        assert not np.any(mask & ~dense)
+        assert np.count_nonzero(dense & ~mask) <= 0.01 * np.count_nonzero(dense)
+        assert 0.0 <= missed <= 0.01
+        if k >= 8:
+            # Far above the noise only the blocks around the moving objects are filtered
+            assert filtered.mean() < 0.5
+
+
+def test_sparse_mask_filters_everything_in_the_noise():
+    frames, _ = synthetic_sequence(17, 240, 320)
+    deriv = filters.spatio_temporal_derivative(frames, 8, None, None, 'simple', None)
+    threshold = 3 * estimate_noise_sigma(deriv)
+    mask, _, filtered, missed = sparse_motion_mask(frames, 8, threshold, None, None, 'simple', None)
+    assert filtered.all() and missed == 0.0
+    np.testing.assert_array_equal(mask, np.abs(deriv) > threshold)
@@ -0,0 +1,82 @@
+import itertools
+import threading
+import time
+
+import pytest
+
+from staged import Stage, run_pipeline
+
+
+def _run_in_thread(stages, **kwargs):
+    # run_pipeline in a helper thread, so a pipeline that fails to stop fails the test instead of hanging it
+    outcome = {}
+
+    def target():
+        try:
+            outcome['wall'] = run_pipeline(stages, **kwargs)
+        except Exception as e:
+            outcome['error'] = e
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout=20)
+    assert not thread.is_alive(), 'pipeline did not finish'
+    return outcome
+
+
+@pytest.mark.parametrize('threaded', [True, False])
+def test_pipeline_passes_items_in_order(threaded):
+    received = []
+    stages = [Stage('source', lambda: iter(range(100))),
+              Stage('square', lambda items: (i * i for i in items)),
+              Stage('sink', lambda items: received.extend(items) or ())]
+    run_pipeline(stages, queue_size=2, threaded=threaded)
+    assert received == [i * i for i in range(100)]
+    if threaded:
+        assert [stage.items for stage in stages] == [100, 100, 100]
+
+
+def test_stage_error_stops_the_others_and_is_reraised():
+    error = RuntimeError('stage failed')
+    consumed = []
+
+    def fail(items):
+        for i in items:
+            if i == 10:
+                raise error
+            yield i
+
+    # An endless source and a sink only stop if the failure is propagated
+    stages = [Stage('source', lambda: itertools.count()), Stage('fail', fail),
+              Stage('sink', lambda items: consumed.extend(items) or ())]
+    outcome = _run_in_thread(stages, queue_size=3)
+    assert outcome.get('error') is error
+    assert consumed == list(range(10))
+
+
+@pytest.mark.parametrize('queue_size', [1, 4])
+def test_full_queue_blocks_the_producer(queue_size):
+    produced = []
+    release = threading.Event()
+    received = []
+
+    def source():
+        for i in range(30):
+            produced.append(i)
+            yield i
+
+    def sink(items):
+        release.wait(10)
+        received.extend(items)
+        return ()
+
+    stages = [Stage('source', source), Stage('sink', sink)]
+    thread = threading.Thread(target=run_pipeline, args=(stages, queue_size), daemon=True)
+    thread.start()
+    time.sleep(0.5)
+    # queue_size items wait in the queue and one more is blocked in put()
+    assert len(produced) == queue_size + 1
+    release.set()
+    thread.join(timeout=20)
+    assert received == list(range(30))
+    assert stages[0].wait_out > 0.3
@@ -0,0 +1,61 @@
+import numpy as np
+
+from thresholds import PixelNoiseModel
+
+
+def test_pixel_model_update_is_in_place_ewma():
+    rng = np.random.default_rng(0)
+    frames = rng.normal(0.5, 2.0, (200, 16, 24))
+    model = PixelNoiseModel(alpha=0.05)
+    model.update(frames[0])
+    buffers = [model.mean, model.var, model._delta, model._weight, model._scratch]
+    for frame in frames[1:]:
+        model.update(frame)
+    # Same buffers every frame, whatever the length of the stream
+    assert all(a is b for a, b in zip(buffers, [model.mean, model.var, model._delta, model._weight, model._scratch]))
+    assert model.frames == len(frames)
+    # The mean is the exponentially-weighted average of the frames from a zero start
+    weights = 0.05 * 0.95 ** np.arange(len(frames))[::-1]
+    np.testing.assert_allclose(model.mean, np.tensordot(weights, frames, axes=1), rtol=1e-4, atol=1e-4)
+    # and the variance tracks the noise of the stream
+    assert abs(np.sqrt(model.var).mean() - 2.0) < 0.2
+
+
+def test_pixel_model_masks_against_its_own_sigma():
+    sigma = {}
+    for exclude in (True, False):
+        rng = np.random.default_rng(1)
+        model = PixelNoiseModel(alpha=0.05)
+        for _ in range(100):
+            model.threshold(rng.standard_normal((64, 64)))
+        frame = rng.standard_normal((64, 64))
+        frame[10:20, 10:20] += 20
+        mask = model.threshold(frame, k=4, exclude_foreground=exclude)
+        assert mask.dtype == np.uint8
+        assert mask[10:20, 10:20].all()
+        assert mask.mean() < 0.03
+        sigma[exclude] = np.sqrt(model.var[10:20, 10:20]).max()
+    # A one-frame object moves the sigma under it far less when down-weighted
+    assert sigma[True] < 2.0 < 4.0 < sigma[False]
+
+
+def swaying(rng, shape):
+    # Foliage-like derivative: large values of either sign, never near zero
+    return 10 * np.sign(rng.standard_normal(shape)) + rng.standard_normal(shape)
+
+
+def test_pixel_model_adapts_to_region_that_becomes_noisier():
+    rng = np.random.default_rng(2)
+    flagged = {}
+    for foreground_alpha in (0.0, 0.005):
+        model = PixelNoiseModel(alpha=0.05, foreground_alpha=foreground_alpha)
+        for _ in range(50):
+            model.threshold(rng.standard_normal((32, 32)))
+        for _ in range(300):
+            frame = rng.standard_normal((32, 32))
+            frame[:16] = swaying(rng, (16, 32))
+            mask = model.threshold(frame, k=4)
+        flagged[foreground_alpha] = mask[:16].mean()
+    # Excluded entirely the region is flagged forever; down-weighted it adapts
+    assert flagged[0.0] == 1.0
+    assert flagged[0.005] < 0.05
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+from scipy.ndimage import gaussian_filter, label
+
+from metrics import analyze_derivative, compute_largest_component_ratio
+from tiled import tiled_analyze_derivative, tiled_largest_component, tiled_percentiles
+
+SHAPES = [((97, 131), 32), ((50, 77), 16), ((64, 96), 32), ((33, 200), 64)]
+
+
+def _derivative(shape, seed):
+    rng = np.random.default_rng(seed)
+    derivative = 4 * gaussian_filter(rng.standard_normal(shape), 1.5)
+    # Smooth blobs give components that wind across several tile borders
+    derivative += 3 * gaussian_filter(rng.standard_normal(shape), 6) * np.sqrt(72)
+    return derivative
+
+
+@pytest.mark.parametrize('shape, tile_size', SHAPES)
+@pytest.mark.parametrize('seed', range(3))
+def test_tiled_analysis_matches_whole_frame(shape, tile_size, seed):
+    derivative = _derivative(shape, seed)
+    strategies = [('percentile', 50), ('percentile', 90), ('percentile', 99), ('noise', 3), ('fixed', 1.0)]
+    snr, expected = analyze_derivative(derivative, strategies)
+    tiled_snr, results = tiled_analyze_derivative(derivative, strategies, tile_size)
+    assert tiled_snr == pytest.approx(snr)
+    for e, r in zip(expected, results):
+        assert r['threshold'] == e['threshold']
+        np.testing.assert_array_equal(r['mask'], e['mask'])
+        assert r['motion_pct'] == e['motion_pct']
+        assert r['lcc'] == pytest.approx(e['lcc'])
+        assert r['sigma_noise'] == e['sigma_noise']
+
+
+@pytest.mark.parametrize('shape, tile_size', SHAPES)
+def test_tiled_percentiles_match_numpy(shape, tile_size):
+    values = np.abs(np.round(_derivative(shape, 5), 1))
+    percentiles = [0, 12.5, 50, 95, 99.9, 100]
+    np.testing.assert_array_equal(tiled_percentiles(values, percentiles, tile_size),
+                                  np.percentile(values, percentiles))
+
+
+@pytest.mark.parametrize('shape, tile_size', SHAPES)
+@pytest.mark.parametrize('seed', range(3))
+def test_tiled_largest_component_merges_borders(shape, tile_size, seed):
+    abs_d = np.abs(_derivative(shape, seed))
+    for threshold in np.percentile(abs_d, [40, 70, 90]):
+        mask = (abs_d > threshold).astype(np.uint8)
+        lcc, n = tiled_largest_component(mask, tile_size)
+        assert lcc == pytest.approx(compute_largest_component_ratio(mask))
+        assert n == label(mask)[1]
+    # A comb whose teeth join only along the last row, through every tile above it
+    comb = np.zeros(shape, dtype=np.uint8)
+    comb[:, ::2] = 1
+    comb[-1] = 1
+    assert tiled_largest_component(comb, tile_size) == (1.0, 1)
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+import filters
+from frame_source import iter_frames
+from synthetic import write_synthetic_sequence
+from video import iter_video_masks, run_video
+
+
+@pytest.fixture(scope='module')
+def frame_dir(tmp_path_factory):
+    path = tmp_path_factory.mktemp('frames')
+    write_synthetic_sequence(str(path), 12, 48, 64)
+    return str(path)
+
+
+def test_packed_masks_round_trip(frame_dir, tmp_path):
+    out = str(tmp_path / 'video')
+    summary = run_video(frame_dir, out, temporal=('simple', None), strategy=('fixed', 20), chunk_frames=4,
+                        pipelined=False)
+    masks = list(iter_video_masks(out + '/masks'))
+    assert summary['frames'] == len(masks) == 10
+    assert [index for index, _ in masks] == list(range(1, 11))
+    frames = np.stack(list(iter_frames(frame_dir)))
+    for index, mask in masks:
+        expected = np.abs(filters.simple_derivative_filter(frames, index)) > 20
+        np.testing.assert_array_equal(mask, expected)
+
+
+def test_packed_masks_empty_run(frame_dir, tmp_path):
+    out = str(tmp_path / 'video')
+    summary = run_video(frame_dir, out, temporal=('simple', None), start=50, pipelined=False)
+    assert summary['frames'] == 0
+    assert list(iter_video_masks(out + '/masks')) == []
+
+
+def test_writer_closed_when_a_stage_fails(frame_dir, tmp_path):
+    out = str(tmp_path / 'video')
+    with pytest.raises(ValueError):
+        run_video(frame_dir, out, temporal=('simple', None), strategy=('unknown', 1), pipelined=True)
+    assert list(iter_video_masks(out + '/masks')) == []
+
+
+@pytest.mark.parametrize('options', [
+    dict(temporal=('simple', None), strategy=('percentile', 90)),
+    dict(spatial=('gaussian', 1.5), temporal=('gaussian', 1.0), strategy=('noise', 4), running_noise=True),
+    dict(temporal=('causal', 1.5), strategy=('pixel', 4)),
+    dict(temporal=('simple', None), strategy=('fixed', 20), tile_size=16),
+])
+def test_pipelined_run_matches_serial(frame_dir, tmp_path, options):
+    outputs = []
+    for pipelined in (False, True):
+        out = str(tmp_path / f'video_{pipelined}')
+        summary = run_video(frame_dir, out, pipelined=pipelined, queue_size=2, chunk_frames=3, **options)
+        with open(out + '/metrics.csv') as f:
+            outputs.append((summary['frames'], f.read(), list(iter_video_masks(out + '/masks'))))
+    (frames, csv, masks), (frames_p, csv_p, masks_p) = outputs
+    assert frames == frames_p > 0
+    assert csv == csv_p
+    assert [index for index, _ in masks] == [index for index, _ in masks_p]
+    for (_, mask), (_, mask_p) in zip(masks, masks_p):
+        np.testing.assert_array_equal(mask, mask_p)
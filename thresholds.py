@@ -1,5 +1,7 @@
 import numpy as np
 
+from profiling import profiled
+
 
 def threshold_fixed(derivative, value):
     """
@@ -20,14 +22,238 @@ def threshold_percentile(derivative, percentile):
     return mask, thr
 
 
-def threshold_noise_model(derivative, k=3.0):
+@profiled()
+def threshold_noise_model(derivative, k=3.0, sigma_noise=None, method='exact'):
     """
     Adaptive threshold based on modeling background derivatives as Gaussian noise.
+    Pass a precomputed sigma_noise (see estimate_noise_sigma) to sweep k without
+    re-estimating the noise for every value.
     """
     abs_deriv = np.abs(derivative)
-    median_val = np.median(abs_deriv)
-    mad = np.median(np.abs(abs_deriv - median_val))
-    sigma_noise = mad / 0.6745
+    if sigma_noise is None:
+        sigma_noise = noise_sigma_from_abs(abs_deriv, method)
     thr = k * sigma_noise
     mask = (abs_deriv > thr).astype(np.uint8)
-    return mask, thr, sigma_noise
\ No newline at end of file
+    return mask, thr, sigma_noise
+
+
+@profiled()
+def threshold_percentiles(derivative, percentiles, method='exact', bins=4096, packed=False):
+    """
+    Threshold at several percentiles of the absolute derivative in a single pass.
+    method='exact' selects all percentiles with one partition and gives the same
+    thresholds as threshold_percentile. method='histogram' reads them from one
+    cumulative histogram over [0, max|derivative|], accurate to one bin width, which
+    suits bounded-range data such as derivatives of uint8 frames.
+    Returns (masks, thresholds) with masks of shape (P, H, W), or bit-packed along the
+    last axis with np.packbits when packed=True (see unpack_masks).
+    """
+    abs_deriv = np.abs(derivative)
+    thresholds = percentile_values(abs_deriv, percentiles, method, bins)
+    if packed:
+        masks = np.stack([np.packbits(abs_deriv > thr, axis=-1) for thr in thresholds])
+    else:
+        masks = np.empty((len(thresholds),) + abs_deriv.shape, dtype=np.uint8)
+        for i, thr in enumerate(thresholds):
+            masks[i] = abs_deriv > thr
+    return masks, thresholds
+
+
+@profiled()
+def percentile_values(abs_deriv, percentiles, method='exact', bins=4096, bin_edges=False):
+    """
+    Percentiles of an already absolute-valued derivative, exact or histogram-based.
+    With bin_edges, returns (values, lower, upper) where lower / upper are the edges of the
+    histogram bin holding each percentile (the values themselves for method='exact').
+    """
+    if method == 'exact':
+        values = np.percentile(abs_deriv, percentiles)
+        return (values, values, values) if bin_edges else values
+    if method == 'histogram':
+        return _histogram_percentiles(abs_deriv, percentiles, bins, bin_edges)
+    raise ValueError(f"Unknown percentile method: {method}")
+
+
+def _histogram_percentiles(abs_deriv, percentiles, bins, bin_edges=False):
+    top = float(abs_deriv.max()) if abs_deriv.size else 0.0
+    if top == 0:
+        zeros = np.zeros(len(percentiles))
+        return (zeros, zeros, zeros) if bin_edges else zeros
+    hist, edges = np.histogram(abs_deriv, bins=bins, range=(0.0, top))
+    cumulative = np.cumsum(hist)
+    # Same rank convention as np.percentile's linear interpolation
+    ranks = np.asarray(percentiles, dtype=float) / 100 * (abs_deriv.size - 1)
+    idx = np.searchsorted(cumulative, ranks, side='right')
+    idx = np.minimum(idx, bins - 1)
+    below = np.where(idx > 0, cumulative[idx - 1], 0)
+    fraction = (ranks - below + 0.5) / np.maximum(hist[idx], 1)
+    values = edges[idx] + np.clip(fraction, 0, 1) * (edges[idx + 1] - edges[idx])
+    return (values, edges[idx], edges[idx + 1]) if bin_edges else values
+
+
+def unpack_masks(packed_masks, width):
+    """
+    Undo the bit-packing of threshold_percentiles(..., packed=True).
+    """
+    return np.unpackbits(packed_masks, axis=-1, count=width)
+
+
+def estimate_noise_sigma(derivative, method='exact', bins=4096, subsample=1):
+    """
+    Robust noise scale of the derivative, MAD(|derivative|) / 0.6745.
+    method='histogram' takes the median and the MAD from fixed-bin histograms, two
+    O(n) passes instead of two full selections. subsample > 1 estimates from every
+    subsample-th pixel only.
+    """
+    abs_deriv = np.abs(derivative)
+    if subsample > 1:
+        abs_deriv = abs_deriv.ravel()[::subsample]
+    return noise_sigma_from_abs(abs_deriv, method, bins)
+
+
+@profiled()
+def noise_sigma_from_abs(abs_deriv, method='exact', bins=4096, median=None):
+    """
+    estimate_noise_sigma for an already absolute-valued derivative. A known median of
+    abs_deriv can be passed to skip its selection.
+    """
+    if method == 'exact':
+        median_val = np.median(abs_deriv) if median is None else median
+        mad = np.median(np.abs(abs_deriv - median_val))
+    elif method == 'histogram':
+        median_val = _histogram_percentiles(abs_deriv, [50], bins)[0] if median is None else median
+        mad = _histogram_percentiles(np.abs(abs_deriv - median_val), [50], bins)[0]
+    else:
+        raise ValueError(f"Unknown noise estimation method: {method}")
+    return mad / 0.6745
+
+
+class RunningNoiseEstimator:
+    """
+    Exponentially-weighted sigma_noise across the frames of a stream.
+    Each update folds a histogram-based (optionally subsampled) estimate of the new
+    frame into the running value with weight alpha, so the noise level tracks slow
+    changes without a full re-estimation from scratch on every frame.
+    """
+
+    def __init__(self, alpha=0.05, method='histogram', bins=4096, subsample=4):
+        self.alpha = alpha
+        self.method = method
+        self.bins = bins
+        self.subsample = subsample
+        self.sigma_noise = None
+
+    def update(self, derivative):
+        """
+        Fold the derivative of the next frame into the estimate and return it.
+        """
+        sigma = estimate_noise_sigma(derivative, self.method, self.bins, self.subsample)
+        if self.sigma_noise is None:
+            self.sigma_noise = sigma
+        else:
+            self.sigma_noise = (1 - self.alpha) * self.sigma_noise + self.alpha * sigma
+        return self.sigma_noise
+
+    def threshold(self, derivative, k=3.0, update=True):
+        """
+        Noise-model threshold of derivative using the running sigma_noise.
+        """
+        if update or self.sigma_noise is None:
+            self.update(derivative)
+        return threshold_noise_model(derivative, k, sigma_noise=self.sigma_noise)
+
+
+class PixelNoiseModel:
+    """
+    Per-pixel exponentially-weighted mean and variance of the derivative across the frames
+    of a stream, kept in float32 (8 bytes per pixel plus scratch buffers reused every frame).
+    A pixel is foreground when |derivative - mean| > k * sigma_pixel, so regions that are
+    noisier than the rest of the frame (foliage, screens) get a higher threshold. Each update
+    costs a fixed number of in-place operations per pixel; pixels detected as foreground are
+    updated with the smaller weight foreground_alpha, so moving objects barely inflate their
+    own noise estimate while a region that becomes noisier than its sigma (foliage starting
+    to move) still adapts, over roughly 1 / foreground_alpha frames instead of never.
+    The first frame initializes every pixel with a zero mean and the global robust sigma
+    (estimate_noise_sigma). sigma_pixel is floored at min_sigma. Down-weighting the
+    foreground shrinks the tail of the noise distribution in the updates, which for small k
+    shrinks the variance and feeds back into more detections; k of 4 or more is stable.
+    """
+
+    def __init__(self, alpha=0.05, min_sigma=0.0, method='histogram', foreground_alpha=0.005):
+        self.alpha = alpha
+        self.min_sigma = min_sigma
+        self.method = method
+        self.foreground_alpha = foreground_alpha
+        self.mean = None
+        self.var = None
+        self.frames = 0
+
+    def reset(self):
+        self.mean = None
+        self.var = None
+        self.frames = 0
+
+    def _start(self, derivative):
+        shape = np.shape(derivative)
+        sigma = max(estimate_noise_sigma(derivative, self.method), self.min_sigma)
+        self.mean = np.zeros(shape, dtype=np.float32)
+        self.var = np.full(shape, sigma * sigma, dtype=np.float32)
+        self._delta = np.empty(shape, dtype=np.float32)
+        self._weight = np.empty(shape, dtype=np.float32)
+        self._scratch = np.empty(shape, dtype=np.float32)
+
+    def sigma(self):
+        """
+        Current per-pixel sigma, floored at min_sigma.
+        """
+        return np.maximum(np.sqrt(self.var), np.float32(self.min_sigma))
+
+    def _deviation(self, derivative):
+        # delta = derivative - mean, in the float32 scratch buffer
+        np.subtract(np.asarray(derivative, dtype=np.float32), self.mean, out=self._delta)
+        return self._delta
+
+    def update(self, derivative, foreground=None):
+        """
+        Fold the derivative of the next frame into the per-pixel statistics, down-weighting
+        the pixels where `foreground` is set:
+        mean += a * delta, var = (1 - a) * (var + a * delta**2), with a = alpha
+        (foreground_alpha on foreground).
+        """
+        if self.mean is None:
+            self._start(derivative)
+        delta = self._deviation(derivative)
+        self._update(delta, foreground)
+
+    def _update(self, delta, foreground):
+        weight = self._weight
+        if foreground is None:
+            weight.fill(self.alpha)
+        else:
+            np.multiply(foreground, np.float32(self.foreground_alpha - self.alpha), out=weight)
+            weight += np.float32(self.alpha)
+        scratch = self._scratch
+        np.multiply(weight, delta, out=scratch)      # a * delta
+        self.mean += scratch
+        scratch *= delta                             # a * delta**2
+        self.var += scratch
+        np.subtract(np.float32(1), weight, out=weight)
+        self.var *= weight
+        self.frames += 1
+
+    def threshold(self, derivative, k=4.0, update=True, exclude_foreground=True):
+        """
+        Mask |derivative - mean| > k * sigma_pixel from the statistics of the previous frames,
+        then (with update) fold this frame in, down-weighting the detected foreground unless
+        exclude_foreground is False. Returns the uint8 mask.
+        """
+        if self.mean is None:
+            self._start(derivative)
+        delta = self._deviation(derivative)
+        scratch = self._scratch
+        np.maximum(self.var, np.float32(self.min_sigma) ** 2, out=scratch)
+        scratch *= np.float32(k * k)
+        mask = delta * delta > scratch
+        if update:
+            self._update(delta, mask if exclude_foreground else None)
+        return mask.astype(np.uint8)
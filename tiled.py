@@ -0,0 +1,303 @@
+import numpy as np
+from scipy.ndimage import label
+
+from filters import temporal_derivative_kernel, temporal_margin, spatial_margin, smooth_frame
+from frame_source import FrameRingBuffer
+
+
+# Largest number of values gathered in memory to select one order statistic exactly
+MAX_CANDIDATES = 1 << 16
+
+
+def tile_slices(shape, tile_size):
+    """
+    Yield (row slice, column slice) of the tiles covering a frame of the given (H, W) shape.
+    """
+    height, width = shape[-2:]
+    for r0 in range(0, height, tile_size):
+        for c0 in range(0, width, tile_size):
+            yield slice(r0, min(r0 + tile_size, height)), slice(c0, min(c0 + tile_size, width))
+
+
+def region_derivative(frames_array, index, rows, cols, spatial_method, spatial_param, temporal_method,
+                      temporal_sigma=None, dtype=float):
+    """
+    Fused spatio-temporal derivative at frame[index] restricted to frame[rows, cols].
+    The region is read with a halo of spatial_margin pixels (clipped at the frame border),
+    so the result equals the same region of the whole-frame derivative. frames_array only
+    needs integer frame indexing (array, memmap or FrameRingBuffer). The caller checks the
+    temporal support.
+    """
+    weights = temporal_derivative_kernel(temporal_method, temporal_sigma).astype(dtype)
+    margin = len(weights) // 2
+    height, width = np.shape(frames_array[index])
+    halo = spatial_margin(spatial_method, spatial_param)
+    r0, r1 = max(0, rows.start - halo), min(height, rows.stop + halo)
+    c0, c1 = max(0, cols.start - halo), min(width, cols.stop + halo)
+    combined = np.zeros((r1 - r0, c1 - c0), dtype=dtype)
+    for j, w in enumerate(weights):
+        if w != 0:
+            combined += w * np.asarray(frames_array[index - margin + j][r0:r1, c0:c1], dtype=dtype)
+    smoothed = smooth_frame(combined, spatial_method, spatial_param, dtype)
+    return smoothed[rows.start - r0:rows.stop - r0, cols.start - c0:cols.stop - c0]
+
+
+def tiled_derivative(frames_array, index, spatial_method, spatial_param, temporal_method, temporal_sigma=None,
+                     tile_size=1024, dtype=float, out=None):
+    """
+    Fused spatio-temporal derivative at frame[index] (see filters.spatio_temporal_derivative),
+    computed tile by tile with region_derivative, so only a (2*margin+1, tile+2*halo, tile+2*halo)
+    block is in memory at a time and frames_array can be a memory-mapped frame cache.
+    Gaussian smoothing gives results identical to the whole frame; box filters (running sums
+    in scipy) agree to rounding.
+    The result is written to `out` (e.g. a memmap) when given. Returns None without full
+    temporal support.
+    """
+    margin = temporal_margin(temporal_method, temporal_sigma)
+    if index < margin or index >= len(frames_array) - margin:
+        return None
+    if out is None:
+        out = np.empty(np.shape(frames_array[index]), dtype=dtype)
+    for rows, cols in tile_slices(out.shape, tile_size):
+        out[rows, cols] = region_derivative(frames_array, index, rows, cols, spatial_method, spatial_param,
+                                            temporal_method, temporal_sigma, dtype)
+    return out
+
+
+def stream_tiled_derivatives(frames, spatial_method, spatial_param, temporal_method, temporal_sigma=None,
+                             tile_size=1024, dtype=float):
+    """
+    Tiled counterpart of filters.stream_temporal_derivatives: consume an iterable of frames
+    and yield (index, derivative) for every frame with full temporal support, each computed
+    by tiled_derivative from a FrameRingBuffer of the 2*margin+1 frames the kernel needs.
+    The filter temporaries are one tile plus its halo instead of whole frames.
+    """
+    margin = temporal_margin(temporal_method, temporal_sigma)
+    buffer = FrameRingBuffer(2 * margin + 1)
+    for frame in frames:
+        buffer.append(frame)
+        index = len(buffer) - 1 - margin
+        if index < margin:
+            continue
+        yield index, tiled_derivative(buffer, index, spatial_method, spatial_param, temporal_method,
+                                      temporal_sigma, tile_size, dtype)
+
+
+def _tiled_order_statistics(tiles, ranks, bins=4096):
+    """
+    Exact values at integer `ranks` of the sorted concatenation of all tiles, without
+    concatenating them. tiles is a zero-arg callable returning a fresh iterator over the
+    tile arrays. Each pass histograms the values inside the current window of every rank
+    (merging the per-tile histograms) and narrows the window to the bin holding the rank,
+    until few enough candidates remain to be selected directly.
+    """
+    lo = min(t.min() for t in tiles())
+    hi = max(t.max() for t in tiles())
+    windows = {r: (lo, hi) for r in ranks}
+    found = {}
+    while windows:
+        below = dict.fromkeys(windows, 0)
+        inside = dict.fromkeys(windows, 0)
+        hists = dict.fromkeys(windows, 0)
+        edges = {}
+        for t in tiles():
+            for r, (w_lo, w_hi) in windows.items():
+                below[r] += int(np.count_nonzero(t < w_lo))
+                sel = t[(t >= w_lo) & (t <= w_hi)]
+                inside[r] += sel.size
+                if w_hi > w_lo and edges.get(r, ()) is not None:
+                    try:
+                        hist, edges[r] = np.histogram(sel, bins=bins, range=(w_lo, w_hi))
+                        hists[r] = hists[r] + hist
+                    except ValueError:
+                        # Window too narrow to split into `bins` floats: select directly
+                        edges[r] = None
+        collect = []
+        for r, (w_lo, w_hi) in list(windows.items()):
+            if w_hi == w_lo:
+                found[r] = w_lo
+                del windows[r]
+            elif inside[r] <= MAX_CANDIDATES or edges[r] is None:
+                collect.append(r)
+            else:
+                # np.histogram's bins are exact with respect to its edges, so the rank lies
+                # in bin b, i.e. in [edges[b], edges[b + 1]]
+                b = int(np.searchsorted(np.cumsum(hists[r]), r - below[r], side='right'))
+                new_window = (edges[r][b], edges[r][b + 1])
+                if new_window == (w_lo, w_hi):
+                    collect.append(r)
+                else:
+                    windows[r] = new_window
+        if collect:
+            candidates = {r: [] for r in collect}
+            for t in tiles():
+                for r in collect:
+                    w_lo, w_hi = windows[r]
+                    candidates[r].append(t[(t >= w_lo) & (t <= w_hi)])
+            for r in collect:
+                found[r] = np.sort(np.concatenate(candidates[r]))[r - below[r]]
+                del windows[r]
+    return [found[r] for r in ranks]
+
+
+def _lerp(a, b, t):
+    # Same interpolation (and rounding) as np.percentile's linear method
+    diff = b - a
+    return b - diff * (1 - t) if t >= 0.5 else a + diff * t
+
+
+def tiled_percentiles(values, percentiles, tile_size=1024, bins=4096):
+    """
+    Exact np.percentile(values, percentiles) computed over tiles of a 2D array, with a
+    working set of one tile plus the selected candidates.
+    """
+    tiles = lambda: (values[rows, cols] for rows, cols in tile_slices(values.shape, tile_size))
+    return _tiled_percentiles(tiles, values.size, percentiles, bins)
+
+
+def _tiled_percentiles(tiles, n, percentiles, bins):
+    virtual = (n - 1) * (np.asarray(percentiles, dtype=float) / 100)
+    below = np.floor(virtual).astype(int)
+    above = np.minimum(below + 1, n - 1)
+    order = dict(zip(sorted(set(below) | set(above)),
+                     _tiled_order_statistics(tiles, sorted(set(below) | set(above)), bins)))
+    return np.array([_lerp(order[lo], order[hi], v - lo) for v, lo, hi in zip(virtual, below, above)])
+
+
+def _tiled_median(tiles, n, bins):
+    # np.median: middle value, or the mean of the two middle values
+    ranks = [(n - 1) // 2, n // 2]
+    values = _tiled_order_statistics(tiles, sorted(set(ranks)), bins)
+    return np.mean(np.array([values[0], values[-1]]))
+
+
+def tiled_noise_sigma(abs_deriv, median=None, tile_size=1024, bins=4096):
+    """
+    Exact MAD(|derivative|) / 0.6745 (thresholds.noise_sigma_from_abs, method='exact')
+    computed over tiles of the absolute derivative.
+    """
+    n = abs_deriv.size
+    slices = list(tile_slices(abs_deriv.shape, tile_size))
+    if median is None:
+        median = _tiled_median(lambda: (abs_deriv[s] for s in slices), n, bins)
+    mad = _tiled_median(lambda: (np.abs(abs_deriv[s] - median) for s in slices), n, bins)
+    return mad / 0.6745
+
+
+def tiled_largest_component(mask, tile_size=1024):
+    """
+    Largest-component ratio and number of components of a mask (4-connectivity, as
+    metrics.compute_largest_component_ratio), labeling one tile at a time.
+    Components touching across a tile border are merged with a union-find over the tile
+    labels, using only the border rows and columns of neighbouring tiles.
+    Returns (lcc, num_components).
+    """
+    sizes = [np.zeros(1, dtype=np.int64)]
+    offset = 0
+    bottom, right = {}, {}
+    pairs = []
+    for rows, cols in tile_slices(mask.shape, tile_size):
+        local, num = label(mask[rows, cols])
+        sizes.append(np.bincount(local.ravel(), minlength=num + 1)[1:])
+        labeled = np.where(local > 0, local + offset, 0)
+        # Pair labels of foreground pixels facing each other across the top and left borders
+        for edge, facing in ((labeled[0], bottom.pop((rows.start, cols.start), None)),
+                             (labeled[:, 0], right.pop((rows.start, cols.start), None))):
+            if facing is not None:
+                both = (edge > 0) & (facing > 0)
+                pairs.append(np.stack([edge[both], facing[both]], axis=1))
+        bottom[(rows.stop, cols.start)] = labeled[-1]
+        right[(rows.start, cols.stop)] = labeled[:, -1]
+        offset += num
+    sizes = np.concatenate(sizes)
+    total = sizes.sum()
+    if total == 0:
+        return 0.0, 0
+
+    parent = np.arange(offset + 1)
+
+    def find(p):
+        while parent[p] != p:
+            parent[p] = parent[parent[p]]
+            p = parent[p]
+        return p
+
+    if pairs:
+        for a, b in np.unique(np.concatenate(pairs), axis=0).tolist():
+            ra, rb = find(a), find(b)
+            if ra != rb:
+                parent[max(ra, rb)] = min(ra, rb)
+    # Flatten the forest so every label points at its root
+    while True:
+        grandparent = parent[parent]
+        if np.array_equal(grandparent, parent):
+            break
+        parent = grandparent
+    merged = np.bincount(parent[1:], weights=sizes[1:])
+    return merged.max() / total, int(np.count_nonzero(merged))
+
+
+def tiled_analyze_derivative(derivative, strategies, tile_size=1024, bins=4096):
+    """
+    Tiled counterpart of metrics.analyze_derivative (exact percentile and noise methods).
+    Percentile and MAD thresholds come from merged per-tile histograms plus exact candidate
+    selection, masks are thresholded tile by tile and the LCC is merged across tile borders,
+    so thresholds, masks, motion % and LCC are identical to the whole-frame path; the SNR
+    sums are accumulated per tile and agree to rounding.
+    Returns (snr, results) like analyze_derivative.
+    """
+    slices = list(tile_slices(derivative.shape, tile_size))
+    abs_tiles = lambda: (np.abs(derivative[s]) for s in slices)
+    n = derivative.size
+    pcts = [param for kind, param in strategies if kind == 'percentile']
+    stats = _tiled_percentiles(abs_tiles, n, [50, 95] + pcts, bins)
+    p50, p95, pct_thrs = stats[0], stats[1], list(stats[2:])
+    snr = _tiled_snr(abs_tiles, p50, p95)
+
+    sigma_noise = None
+    if any(kind == 'noise' for kind, _ in strategies):
+        abs_median = p50
+        mad = _tiled_median(lambda: (np.abs(t - abs_median) for t in abs_tiles()), n, bins)
+        sigma_noise = mad / 0.6745
+
+    results = []
+    for kind, param in strategies:
+        if kind == 'fixed':
+            thr = param
+        elif kind == 'percentile':
+            thr = pct_thrs.pop(0)
+        elif kind == 'noise':
+            thr = param * sigma_noise
+        else:
+            raise ValueError(f"Unknown threshold strategy: {kind}")
+        mask = np.empty(derivative.shape, dtype=np.uint8)
+        for s in slices:
+            mask[s] = np.abs(derivative[s]) > thr
+        lcc, _ = tiled_largest_component(mask, tile_size)
+        results.append({
+            'strategy': kind, 'param': param, 'threshold': thr, 'mask': mask,
+            'motion_pct': 100 * np.count_nonzero(mask) / mask.size,
+            'lcc': lcc,
+            'sigma_noise': sigma_noise if kind == 'noise' else None,
+        })
+    return snr, results
+
+
+def _tiled_snr(abs_tiles, p50, p95):
+    # metrics.compute_derivative_snr from per-tile float64 sums (two passes for the std)
+    fg_sum = fg_n = bg_sum = bg_n = 0
+    for t in abs_tiles():
+        fg = t[t >= p95]
+        bg = t[t <= p50]
+        fg_sum += np.sum(fg, dtype=np.float64)
+        fg_n += fg.size
+        bg_sum += np.sum(bg, dtype=np.float64)
+        bg_n += bg.size
+    if bg_n == 0:
+        return 0.0
+    bg_mean = bg_sum / bg_n
+    bg_var = sum(np.sum((t[t <= p50] - bg_mean) ** 2, dtype=np.float64) for t in abs_tiles()) / bg_n
+    bg_std = np.sqrt(bg_var)
+    if bg_std == 0:
+        return 0.0
+    return (fg_sum / fg_n) / (bg_std + 1e-8)
@@ -0,0 +1,211 @@
+import csv
+import json
+import os
+import time
+import numpy as np
+from PIL import Image
+
+from filters import stream_temporal_derivatives, CausalGaussianDerivative, smooth_frame, PRECISION_DTYPES
+from frame_source import iter_frames
+from metrics import analyze_derivative, compute_derivative_snr, compute_largest_component_ratio
+from thresholds import RunningNoiseEstimator, PixelNoiseModel
+from tiled import tiled_analyze_derivative, tiled_largest_component, stream_tiled_derivatives
+from staged import Stage, run_pipeline
+
+
+MASK_FORMATS = ('packed', 'png')
+
+
+class PackedMaskWriter:
+    """
+    Write one bit-packed mask per frame into fixed-size chunks masks_XXXXX.npy, each
+    of shape (chunk_frames, H, ceil(W / 8)). Only the current chunk is kept in memory.
+    close() writes index.json with the frame indices and the mask shape.
+    """
+
+    def __init__(self, path, chunk_frames=256):
+        self.path = path
+        self.chunk_frames = chunk_frames
+        self.frame_indices = []
+        self.shape = None
+        self._chunk = []
+        self._n_chunks = 0
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, index, mask):
+        self.shape = mask.shape
+        self.frame_indices.append(int(index))
+        self._chunk.append(np.packbits(mask.astype(bool), axis=-1))
+        if len(self._chunk) == self.chunk_frames:
+            self._flush()
+
+    def _flush(self):
+        if self._chunk:
+            np.save(os.path.join(self.path, f'masks_{self._n_chunks:05d}.npy'), np.stack(self._chunk))
+            self._n_chunks += 1
+            self._chunk = []
+
+    def close(self):
+        self._flush()
+        with open(os.path.join(self.path, 'index.json'), 'w') as f:
+            json.dump({'frames': self.frame_indices, 'shape': self.shape,
+                       'chunk_frames': self.chunk_frames, 'chunks': self._n_chunks}, f)
+
+
+class PngMaskWriter:
+    """
+    Write each mask as mask_<frame>.png (0 / 255) as soon as it is produced.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, index, mask):
+        Image.fromarray((mask > 0).astype(np.uint8) * 255).save(os.path.join(self.path, f'mask_{index:06d}.png'))
+
+    def close(self):
+        pass
+
+
+def iter_video_masks(path):
+    """
+    Read back the masks written by PackedMaskWriter, yielding (frame index, mask)
+    one chunk at a time. A run that wrote no masks yields nothing.
+    """
+    with open(os.path.join(path, 'index.json')) as f:
+        index = json.load(f)
+    frames = index['frames']
+    if not frames:
+        return
+    width = index['shape'][-1]
+    for chunk in range(index['chunks']):
+        packed = np.load(os.path.join(path, f'masks_{chunk:05d}.npy'), mmap_mode='r')
+        offset = chunk * index['chunk_frames']
+        for i in range(len(packed)):
+            yield frames[offset + i], np.unpackbits(packed[i], axis=-1, count=width)
+
+
+def stream_derivatives(frames, spatial_method, spatial_param, temporal_method, temporal_sigma=None,
+                       dtype=float):
+    """
+    Yield (index, derivative) over a stream of frames for one spatial/temporal configuration.
+    'simple' and 'gaussian' use the fused windowed filters (frames without full temporal
+    support at both ends are skipped); 'causal' uses CausalGaussianDerivative and yields
+    every frame, lagging by its `delay`.
+    """
+    if temporal_method == 'causal':
+        causal = CausalGaussianDerivative(temporal_sigma, dtype=dtype)
+        for index, frame in enumerate(frames):
+            deriv = causal.update(frame)
+            if spatial_method is not None:
+                deriv = smooth_frame(deriv, spatial_method, spatial_param, dtype)
+            yield index, deriv
+    else:
+        yield from stream_temporal_derivatives(frames, temporal_method, temporal_sigma, dtype,
+                                               spatial_method, spatial_param)
+
+
+def run_video(image_dir, output_dir, spatial=(None, None), temporal=('simple', None), strategy=('percentile', 90),
+              mask_format='packed', frame_dtype=float, dtype=float, percentile_method='exact',
+              noise_method='exact', running_noise=False, chunk_frames=256, start=0, stop=None, progress_every=0,
+              tile_size=None, pipelined=False, queue_size=4, pixel_alpha=0.05):
+    """
+    Motion mask for every frame of image_dir with one configuration, streamed to output_dir.
+    spatial is (method, param) with method None for no smoothing, temporal is (method, sigma)
+    and strategy is a (kind, param) threshold strategy as in metrics.analyze_derivative.
+    With running_noise, the 'noise' strategy uses a RunningNoiseEstimator across frames
+    instead of a fresh estimate per frame. The ('pixel', k) strategy thresholds each pixel at
+    k times its own noise sigma, tracked by a thresholds.PixelNoiseModel with weight
+    pixel_alpha (the threshold column then holds k times the mean sigma the mask was taken
+    with). With tile_size set, the derivative (tiled.stream_tiled_derivatives; the 'causal' filter keeps whole-frame
+    state and is not tiled) and the thresholds, masks and metrics
+    (tiled.tiled_analyze_derivative) are computed tile by tile. Tiling needs the exact
+    percentile and noise methods.
+    Masks go to output_dir/masks (chunked bit-packed .npy or one PNG per frame) and the
+    per-frame threshold, motion %, SNR and LCC to output_dir/metrics.csv. Frames are
+    decoded lazily and only the temporal window is kept, so memory does not grow with
+    the sequence length.
+    The work is split into decode, filter, threshold and write stages. With pipelined=True
+    they run concurrently on threads connected by queues of queue_size items
+    (staged.run_pipeline), otherwise one after the other for each frame.
+    Returns a summary dict with the number of frames, the elapsed seconds, the frames per
+    second and the stages (whose statistics are filled in when pipelined).
+    """
+    if mask_format not in MASK_FORMATS:
+        raise ValueError(f"Unknown mask format: {mask_format}")
+    if tile_size and (percentile_method != 'exact' or noise_method != 'exact'):
+        raise ValueError("Tiled video processing supports only the 'exact' percentile and noise methods")
+    os.makedirs(output_dir, exist_ok=True)
+    mask_dir = os.path.join(output_dir, 'masks')
+    writer = PackedMaskWriter(mask_dir, chunk_frames) if mask_format == 'packed' else PngMaskWriter(mask_dir)
+    kind, param = strategy
+    estimator = RunningNoiseEstimator() if kind == 'noise' and running_noise else None
+    pixel_model = PixelNoiseModel(pixel_alpha) if kind == 'pixel' else None
+
+    def decode():
+        return iter_frames(image_dir, start, stop, dtype=frame_dtype)
+
+    def derive(frames):
+        if tile_size and temporal[0] != 'causal':
+            return stream_tiled_derivatives(frames, spatial[0], spatial[1], temporal[0], temporal[1], tile_size, dtype)
+        return stream_derivatives(frames, spatial[0], spatial[1], temporal[0], temporal[1], dtype)
+
+    def threshold(derivatives):
+        for index, deriv in derivatives:
+            if pixel_model is not None:
+                # Report the threshold the mask was taken with, before this frame is folded in
+                mask = pixel_model.threshold(deriv, param, update=False)
+                frame_threshold = param * float(np.mean(pixel_model.sigma()))
+                pixel_model.update(deriv, mask)
+                lcc = tiled_largest_component(mask, tile_size)[0] if tile_size else compute_largest_component_ratio(mask)
+                res = {'threshold': frame_threshold, 'mask': mask,
+                       'motion_pct': 100 * np.count_nonzero(mask) / mask.size, 'lcc': lcc}
+                yield start + index, compute_derivative_snr(deriv), res
+                continue
+            frame_strategy = ('fixed', param * estimator.update(deriv)) if estimator is not None else strategy
+            if tile_size:
+                snr, (res,) = tiled_analyze_derivative(deriv, [frame_strategy], tile_size)
+            else:
+                snr, (res,) = analyze_derivative(deriv, [frame_strategy], percentile_method, noise_method)
+            yield start + index, snr, res
+
+    n_done = 0
+    t_start = time.perf_counter()
+
+    def write(results):
+        nonlocal n_done
+        for index, snr, res in results:
+            writer.write(index, res['mask'])
+            rows.writerow([index, f"{res['threshold']:.4f}", f"{res['motion_pct']:.4f}",
+                           f"{snr:.4f}", f"{res['lcc']:.4f}"])
+            n_done += 1
+            if progress_every and n_done % progress_every == 0:
+                elapsed = time.perf_counter() - t_start
+                print(f"{n_done} frames, {n_done / elapsed:.1f} fps")
+        return ()
+
+    stages = [Stage('decode', decode), Stage('filter', derive), Stage('threshold', threshold), Stage('write', write)]
+    with open(os.path.join(output_dir, 'metrics.csv'), 'w', newline='') as f:
+        rows = csv.writer(f)
+        rows.writerow(['frame', 'threshold', 'motion_pct', 'snr', 'lcc'])
+        try:
+            run_pipeline(stages, queue_size, threaded=pipelined)
+        finally:
+            writer.close()
+
+    elapsed = time.perf_counter() - t_start
+    return {'frames': n_done, 'seconds': elapsed, 'fps': n_done / elapsed if elapsed > 0 else 0.0,
+            'stages': stages}
+
+
+def run_video_config(cfg, progress_every=0):
+    """
+    run_video on cfg.IMAGE_DIR with the VIDEO_* settings of a config module (or namespace).
+    """
+    frame_dtype, work_dtype = PRECISION_DTYPES[cfg.PRECISION]
+    return run_video(cfg.IMAGE_DIR, cfg.VIDEO_OUTPUT_DIR, cfg.VIDEO_SPATIAL, cfg.VIDEO_TEMPORAL, cfg.VIDEO_THRESHOLD,
+                     cfg.VIDEO_MASK_FORMAT, frame_dtype, work_dtype, cfg.PERCENTILE_METHOD, cfg.NOISE_METHOD,
+                     cfg.VIDEO_RUNNING_NOISE, cfg.VIDEO_CHUNK_FRAMES, progress_every=progress_every,
+                     tile_size=cfg.VIDEO_TILE_SIZE, pipelined=cfg.VIDEO_PIPELINED, queue_size=cfg.VIDEO_QUEUE_SIZE,
+                     pixel_alpha=cfg.VIDEO_PIXEL_NOISE_ALPHA)
@@ -1,83 +1,75 @@
 import numpy as np
-import matplotlib.pyplot as plt
-from thresholds import threshold_fixed, threshold_percentile, threshold_noise_model
+from thresholds import threshold_fixed, threshold_percentiles, threshold_noise_model, estimate_noise_sigma
+from render import mask_cell, overlay_cell, histogram_cell, make_figure, save_figures
+from profiling import profiled
 
 
+@profiled()
 def visualize_threshold_analysis_fixed_thresholds(test_derivatives, grayscale_images, test_frame_idx,
-                                     fixed_thresholds, output_dir):
+                                     fixed_thresholds, output_dir, render_backend='matplotlib', workers=None,
+                                     skip_unchanged=False):
     """
     Sweep over fixed threshold values for each temporal filter.
     Each column is a different threshold. Row 0: binary mask, Row 1: overlay.
     Shows how motion detection changes with increasing threshold.
     """
+    figures = []
     for t_name, deriv in test_derivatives.items():
         n_thr = len(fixed_thresholds)
-        fig, axes = plt.subplots(2, n_thr, figsize=(4 * n_thr, 8))
-        plt.subplots_adjust(hspace=0.05, wspace=0.05)
+        mask_row, overlay_row = [], []
 
-        for i, thr_val in enumerate(fixed_thresholds):
+        for thr_val in fixed_thresholds:
             mask, thr = threshold_fixed(deriv, thr_val)
             mp = 100 * np.sum(mask) / mask.size
-            axes[0, i].imshow(mask, cmap='gray', vmin=0, vmax=1)
-            axes[0, i].set_title(f'thr={thr_val}\n{mp:.1f}%', fontsize=10)
-            axes[0, i].axis('off')
-            overlay = grayscale_images[test_frame_idx].copy()
-            overlay[mask == 1] = 255
-            axes[1, i].imshow(overlay, cmap='gray')
-            axes[1, i].axis('off')
+            mask_row.append(mask_cell(mask, f'thr={thr_val}\n{mp:.1f}%', fontsize=10))
+            overlay_row.append(overlay_cell(grayscale_images[test_frame_idx], mask))
 
         safe = t_name.replace(' ', '_').replace('[', '').replace(']', '').replace(',', '')
-        plt.savefig(f'{output_dir}/fixed_thresholds_{safe}.png', dpi=150, bbox_inches='tight')
-        plt.close()
+        figures.append(make_figure(f'{output_dir}/fixed_thresholds_{safe}.png', [mask_row, overlay_row],
+                                   figsize=(4 * n_thr, 8)))
+    save_figures(figures, render_backend, workers, skip_unchanged)
 
 
+@profiled()
 def visualize_threshold_analysis_noise_model(test_derivatives, grayscale_images, test_frame_idx,
-                                 k_values, output_dir):
+                                 k_values, output_dir, noise_method='exact', render_backend='matplotlib',
+                                 workers=None, skip_unchanged=False):
     """
     Visualize the noise-model adaptive threshold for each temporal filter.
     Each column is a different k multiplier. Three rows per column:
     Row 0: histogram of |derivative| with threshold line,
     Row 1: binary mask, Row 2: overlay on original frame.
+    The histogram row is always drawn with matplotlib, whatever the backend.
     """
+    figures = []
     for t_name, deriv in test_derivatives.items():
         abs_deriv = np.abs(deriv)
-        median_val = np.median(abs_deriv)
-        mad = np.median(np.abs(abs_deriv - median_val))
-        sigma_noise = mad / 0.6745
-
-        fig, axes = plt.subplots(3, len(k_values), figsize=(5 * len(k_values), 12))
-        plt.subplots_adjust(hspace=0.15, wspace=0.05)
+        sigma_noise = estimate_noise_sigma(deriv, method=noise_method)
+        xmax = np.percentile(abs_deriv, 99.5)
+        hist_row, mask_row, overlay_row = [], [], []
 
         for i, k in enumerate(k_values):
-            mask, thr, _ = threshold_noise_model(deriv, k=k)
+            mask, thr, _ = threshold_noise_model(deriv, k=k, sigma_noise=sigma_noise)
             mp = 100 * np.sum(mask) / mask.size
 
             # Histogram with threshold line
-            axes[0, i].hist(abs_deriv.ravel(), bins=100, color='steelblue', alpha=0.7, density=True)
-            axes[0, i].axvline(thr, color='red', linewidth=2, label=f'k={k}, thr={thr:.1f}')
-            axes[0, i].set_title(f'k={k} (thr={thr:.2f})', fontsize=10)
-            axes[0, i].set_xlim(0, np.percentile(abs_deriv, 99.5))
-            axes[0, i].set_xlabel('|Pixel Derivative Value|', fontsize=9)
-            axes[0, i].legend(fontsize=8)
-            if i == 0:
-                axes[0, i].set_ylabel('Density', fontsize=10)
-
-            axes[1, i].imshow(mask, cmap='gray', vmin=0, vmax=1)
-            axes[1, i].set_title(f'Motion: {mp:.1f}%', fontsize=10)
-            axes[1, i].axis('off')
-
-            overlay = grayscale_images[test_frame_idx].copy()
-            overlay[mask == 1] = 255
-            axes[2, i].imshow(overlay, cmap='gray')
-            axes[2, i].axis('off')
+            hist_row.append(histogram_cell(abs_deriv, thr, f'k={k}, thr={thr:.1f}', f'k={k} (thr={thr:.2f})', xmax,
+                                           ylabel='Density' if i == 0 else None))
+            mask_row.append(mask_cell(mask, f'Motion: {mp:.1f}%', fontsize=10))
+            overlay_row.append(overlay_cell(grayscale_images[test_frame_idx], mask))
 
         safe = t_name.replace(' ', '_').replace('[', '').replace(']', '').replace(',', '')
-        plt.savefig(f'{output_dir}/Noise_model_adaptive_threshold_{safe}.png', dpi=150, bbox_inches='tight')
-        plt.close()
+        figures.append(make_figure(f'{output_dir}/Noise_model_adaptive_threshold_{safe}.png',
+                                   [hist_row, mask_row, overlay_row], figsize=(5 * len(k_values), 12),
+                                   hspace=0.15))
+    save_figures(figures, render_backend, workers, skip_unchanged)
 
 
+@profiled()
 def visualize_threshold_analysis_strategy_comparison(test_derivatives, grayscale_images, test_frame_idx,
-                                       percentile_values, output_dir):
+                                       percentile_values, output_dir, percentile_method='exact',
+                                       noise_method='exact', render_backend='matplotlib', workers=None,
+                                       skip_unchanged=False):
     """
     Compare all three threshold strategies side by side on the simple derivative.
     Columns: fixed thresholds, percentile thresholds, noise-model thresholds.
@@ -89,26 +81,21 @@ def visualize_threshold_analysis_strategy_comparison(test_derivatives, grayscale
     for val in [5, 10, 20]:
         m, t = threshold_fixed(deriv, val)
         strategies[f'Fixed={val}'] = (m, t)
-    for pct in percentile_values:
-        m, t = threshold_percentile(deriv, pct)
+    masks, thrs = threshold_percentiles(deriv, percentile_values, method=percentile_method)
+    for pct, m, t in zip(percentile_values, masks, thrs):
         strategies[f'Pctl={pct}'] = (m, t)
+    sigma_noise = estimate_noise_sigma(deriv, method=noise_method)
     for k in [2.0, 3.0, 4.0, 5.0]:
-        m, t, _ = threshold_noise_model(deriv, k=k)
+        m, t, _ = threshold_noise_model(deriv, k=k, sigma_noise=sigma_noise)
         strategies[f'Noise k={k}'] = (m, t)
 
     n_strats = len(strategies)
-    fig, axes = plt.subplots(2, n_strats, figsize=(3.5 * n_strats, 7))
-    plt.subplots_adjust(hspace=0.05, wspace=0.05)
-
-    for i, (sname, (mask, thr)) in enumerate(strategies.items()):
+    mask_row, overlay_row = [], []
+    for sname, (mask, thr) in strategies.items():
         mp = 100 * np.sum(mask) / mask.size
-        axes[0, i].imshow(mask, cmap='gray', vmin=0, vmax=1)
-        axes[0, i].set_title(f'{sname}\nthr={thr:.1f}, {mp:.1f}%', fontsize=8)
-        axes[0, i].axis('off')
-        overlay = grayscale_images[test_frame_idx].copy()
-        overlay[mask == 1] = 255
-        axes[1, i].imshow(overlay, cmap='gray')
-        axes[1, i].axis('off')
+        mask_row.append(mask_cell(mask, f'{sname}\nthr={thr:.1f}, {mp:.1f}%', fontsize=8))
+        overlay_row.append(overlay_cell(grayscale_images[test_frame_idx], mask))
 
-    plt.savefig(f'{output_dir}/strategy_comparison.png', dpi=150, bbox_inches='tight')
-    plt.close()
\ No newline at end of file
+    figure = make_figure(f'{output_dir}/strategy_comparison.png', [mask_row, overlay_row],
+                         figsize=(3.5 * n_strats, 7))
+    save_figures([figure], render_backend, workers, skip_unchanged)